@@ -1,30 +1,36 @@
 #!/usr/bin/env python
 # coding: utf-8
 
+import os
 import uuid
+import asyncio
 import tempfile
 import shutil
 import logging
+import threading
 from typing import List, Optional
 from contextlib import asynccontextmanager
 from datetime import datetime, timedelta
 from pathlib import Path
 import json
 
-from fastapi import FastAPI, HTTPException, Query
+from fastapi import FastAPI, HTTPException, Query, WebSocket
 from fastapi.responses import StreamingResponse, FileResponse, JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 
-from config import setup_environment
-from langchain_openai import ChatOpenAI
-from langchain_community.tools.tavily_search import TavilySearchResults
-from graph import build_research_team_graph, build_writing_team_graph, build_super_team_graph
+from config import setup_environment, env_flag
+from routing import routing_stats
+from pipeline import DRAFTS_DIR_NAME
+from ws_transport import MultiplexedConnection
+# LangChain, LangGraph and the tools are imported on first use to keep startup fast
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+ARTIFACTS_DIR_NAME = ".artifacts"
+
 # Session class, stores session information and super_team instance
 class Session:
     def __init__(self, super_team, working_dir: Path):
@@ -38,19 +44,75 @@ class Session:
     def update_last_used(self):
         self.last_used = datetime.now()
 
+    def list_files(self) -> List[str]:
+        """Get all files in working directory, as paths relative to it"""
+        files = []
+        for file_path in self.working_dir.glob("**/*"):
+            if file_path.is_file():
+                rel_path = file_path.relative_to(self.working_dir)
+                # Skip internal files such as stored tool output artifacts and draft outlines
+                if rel_path.parts[0] in (ARTIFACTS_DIR_NAME, DRAFTS_DIR_NAME):
+                    continue
+                files.append(str(rel_path))
+        return files
+
 # Session manager
 class SessionManager:
-    def __init__(self):
+    def __init__(self, interactive: bool = False):
         self.sessions = {}
         self.llm = None
+        # Per-node models with pooled clients, None when replaying a cassette
+        self.model_pool = None
         self.tavily_tool = None
+        self.search_cache = None
+        # Replaced by a ReplayTool when replaying a cassette, None means the real scrape_webpages
+        self.scrape_tool = None
+        # Record/replay of LLM and tool interactions, see cassette.py
+        self.cassette = None
+        self.cassette_recorder = None
+        self.replay_speed = "zero"
+        # Server-wide caps applied on top of the budgets requested per run
+        self.budget_caps = None
+        # The API server must never block on a key prompt
+        self.interactive = interactive
+        # Rule-based fast path in front of the LLM routers, AGENT_FAST_ROUTING=0 disables it
+        self.fast_routing = env_flag("AGENT_FAST_ROUTING", default=True)
+        # Start research while the top supervisor's LLM decides, AGENT_SPECULATION=1 enables it
+        self.speculative = env_flag("AGENT_SPECULATION", default=False)
+        # Draft the outline from partial research while research runs, AGENT_PIPELINED=1 enables it
+        self.pipelined = env_flag("AGENT_PIPELINED", default=False)
+        self._init_lock = threading.Lock()
+        self._initialized = False
+
+    @property
+    def initialized(self) -> bool:
+        return self._initialized
 
     def initialize(self):
-        """Initialize environment and shared resources"""
+        """Initialize environment and shared resources, does nothing if already done"""
+        with self._init_lock:
+            if self.initialized:
+                return
+            self._initialize()
+
+    def _initialize(self):
         logger.info("Initializing session manager")
-        setup_environment()
+        setup_environment(interactive=self.interactive)
+
+        from langchain_community.tools.tavily_search import TavilySearchResults
+        from tools import SearchCache, CachedSearchTool, FakeSearchBackend
+        from budget import RunBudget
+        from models import ModelPool
+
+        self.budget_caps = RunBudget.from_env()
+
+        if self._initialize_cassette():
+            self._initialized = True
+            return
 
-        self.llm = ChatOpenAI(model="gpt-4o")
+        # Models per node from AGENT_MODELS_CONFIG, e.g. a small model for the routers
+        self.model_pool = ModelPool.from_env()
+        self.llm = self.model_pool.default_llm
         # self.llm = ChatOpenAI(
         #     model="openai/gpt-4o-2024-11-20",
         #     temperature=0,
@@ -58,13 +120,51 @@ class SessionManager:
         #     base_url="https://openrouter.ai/api/v1",
         # )
 
-        self.tavily_tool = TavilySearchResults(max_results=5)
+        # Searches are cached and deduplicated across sessions, AGENT_SEARCH_BACKEND=fake runs offline
+        if os.environ.get("AGENT_SEARCH_BACKEND") == "fake":
+            search_backend = FakeSearchBackend()
+        else:
+            search_backend = TavilySearchResults(max_results=5)
+        self.search_cache = SearchCache.from_env()
+        self.tavily_tool = CachedSearchTool(search_backend, self.search_cache)
+        self._initialized = True
         logger.info(f"LLM and tools initialization completed: {self.llm}, {self.tavily_tool}")
 
+    def _initialize_cassette(self) -> bool:
+        """Set up recording or replay from AGENT_CASSETTE_*, returns True when replaying"""
+        from cassette import Cassette, CassetteRecorder, ReplayChatModel, ReplayTool, cassette_settings_from_env
+        from tools import FakeSearchBackend, scrape_webpages
+
+        settings = cassette_settings_from_env()
+        if settings["mode"] == "record":
+            self.cassette = Cassette(Path(settings["path"]))
+            self.cassette_recorder = CassetteRecorder(self.cassette)
+            logger.info(f"Recording LLM and tool interactions to {settings['path']}")
+            return False
+        if settings["mode"] != "replay":
+            return False
+
+        # Recorded responses stand in for ChatOpenAI, Tavily and scrape_webpages
+        self.cassette = Cassette.load(Path(settings["path"]))
+        self.replay_speed = settings["speed"]
+        self.llm = ReplayChatModel(cassette=self.cassette, speed=self.replay_speed)
+        # FakeSearchBackend only provides Tavily's tool name and arguments
+        self.tavily_tool = ReplayTool.from_tool(FakeSearchBackend(), self.cassette, self.replay_speed)
+        self.scrape_tool = ReplayTool.from_tool(scrape_webpages, self.cassette, self.replay_speed)
+        logger.info(f"Replaying LLM and tool interactions from {settings['path']} at {self.replay_speed} speed")
+        return True
+
+    def warm_up(self):
+        """Initialize in a background thread, errors are logged and retried on first session"""
+        try:
+            self.initialize()
+        except Exception as e:
+            logger.error(f"Background initialization failed: {str(e)}", exc_info=True)
+
     def create_session(self) -> Session:
         """Create new session"""
         logger.info("Starting to create new session")
-        if self.llm is None:
+        if not self.initialized:
             logger.info("LLM not initialized, initializing now")
             self.initialize()
 
@@ -94,16 +194,49 @@ class SessionManager:
 
     def build_super_team(self, working_dir: Path):
         """Build super_team instance"""
+        from graph import build_research_team_graph, build_writing_team_graph, build_super_team_graph
+        from graph import build_research_writing_pipeline
+        from pipeline import FindingsBoard
+        from tools import ArtifactStore, ToolOutputBudget
+
+        # Oversized tool outputs are kept as session artifacts in a hidden directory
+        artifact_store = ArtifactStore(working_dir / ARTIFACTS_DIR_NAME)
+        paging_tool = None
+        if self.scrape_tool is not None:
+            # Artifacts of the recorded run don't exist here, page through recorded output instead
+            from cassette import ReplayTool
+            paging_tool = ReplayTool.from_tool(
+                ToolOutputBudget(artifact_store).get_paging_tool(), self.cassette, self.replay_speed
+            )
+        output_budget = ToolOutputBudget(artifact_store, paging_tool=paging_tool)
+        findings_board = FindingsBoard() if self.pipelined else None
+
         logger.info("Starting to build research_team")
-        research_team = build_research_team_graph(self.llm, self.tavily_tool)
+        research_team = build_research_team_graph(
+            self.llm, self.tavily_tool, fast_routing=self.fast_routing, output_budget=output_budget,
+            scrape_tool=self.scrape_tool, model_pool=self.model_pool, findings_board=findings_board,
+            speculative=self.speculative,
+        )
         logger.info(f"research_team build completed: {research_team}")
 
         logger.info("Starting to build writing_team")
-        writing_team = build_writing_team_graph(self.llm, working_dir)
+        writing_team = build_writing_team_graph(
+            self.llm, working_dir, fast_routing=self.fast_routing, output_budget=output_budget,
+            model_pool=self.model_pool, pipelined=self.pipelined,
+        )
         logger.info(f"writing_team build completed: {writing_team}")
 
+        pipeline = None
+        if self.pipelined:
+            pipeline = build_research_writing_pipeline(
+                self.llm, working_dir, findings_board, output_budget=output_budget, model_pool=self.model_pool
+            )
+
         logger.info("Starting to build super_team")
-        super_team = build_super_team_graph(self.llm, research_team, writing_team)
+        super_team = build_super_team_graph(
+            self.llm, research_team, writing_team, fast_routing=self.fast_routing, model_pool=self.model_pool,
+            speculative=self.speculative, pipeline=pipeline,
+        )
         logger.info(f"super_team build completed: {super_team}")
 
         return super_team
@@ -140,8 +273,12 @@ session_manager = SessionManager()
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Execute on startup
-    logger.info("Application starting, initializing session manager")
-    session_manager.initialize()
+    logger.info("Application starting")
+    setup_environment(interactive=False)
+    if env_flag("AGENT_EAGER_INIT", default=True):
+        # Warm up LLM clients and tools in the background, the server accepts requests right away
+        logger.info("Initializing session manager in the background")
+        asyncio.get_running_loop().run_in_executor(None, session_manager.warm_up)
     yield
     # Execute on shutdown - clean up all sessions
     logger.info("Application shutting down, cleaning up all sessions")
@@ -169,6 +306,13 @@ class QueryRequest(BaseModel):
     query: str
     recursion_limit: int = 150
     session_id: Optional[str] = None
+    # Per-run budgets, capped by the server-wide AGENT_MAX_RUN_* settings
+    max_seconds: Optional[float] = None
+    max_tokens: Optional[int] = None
+    max_tool_calls: Optional[int] = None
+    max_cost: Optional[float] = None
+    # Attach a sampling profile of the server process to the run timeline
+    profile: bool = False
 
 # Define response model
 class QueryResponse(BaseModel):
@@ -236,14 +380,37 @@ async def get_session_info(session_id: Optional[str] = None):
             headers={"X-Session-ID": session.id}
         )
 
-async def stream_generator(query: str, session: Session, recursion_limit: int = 150):
-    """Async generator for streaming responses"""
+async def run_events(query: str, session: Session, recursion_limit: int = 150, limits: Optional[dict] = None,
+                     profile: bool = False):
+    """Async generator of (event type, data) pairs for one run, shared by all transports
+
+    Event types are "run", which is always first and carries the run id of the
+    timeline, "message", "error", "budget_exhausted" and "end", which is always last.
+    """
+    from langgraph.errors import GraphRecursionError
+    from budget import RunBudget, BudgetTracker
+    from timeline import RunTimeline, SamplingProfiler, timeline_store
+
+    budget = RunBudget(**(limits or {})).capped(session_manager.budget_caps)
+    budget_tracker = BudgetTracker(budget)
+    timeline = RunTimeline(query=query)
+    timeline_store.add(timeline)
+    profiler = None
+    if profile or env_flag("AGENT_PROFILE_RUNS", default=False):
+        profiler = SamplingProfiler(threads=timeline.active_threads)
+        if not profiler.start():
+            profiler = None
+    callbacks = [budget_tracker, timeline]
+    if session_manager.cassette_recorder is not None:
+        callbacks.append(session_manager.cassette_recorder)
     try:
+        yield "run", {"run_id": timeline.run_id, "session_id": session.id}
+
         if session.super_team is None:
             error_msg = "super_team is None, cannot call astream method"
             logger.error(error_msg)
-            yield f"data: ERROR: {error_msg}\n\n"
-            yield f"event: end\ndata: {error_msg}\n\n"
+            yield "error", error_msg
+            yield "end", error_msg
             return
 
         stream_input = {
@@ -251,7 +418,12 @@ async def stream_generator(query: str, session: Session, recursion_limit: int =
                 ("user", query)
             ],
         }
-        stream_config = {"recursion_limit": recursion_limit}
+        stream_config = {
+            "recursion_limit": recursion_limit,
+            "callbacks": callbacks,
+            # run_id scopes per-run state of shared graphs, e.g. committed speculations
+            "configurable": {"budget_tracker": budget_tracker, "run_id": timeline.run_id},
+        }
         # async for response in session.super_team.astream(stream_input, stream_config, stream_mode="updates"):
         #     # Send each result as a separate event
         #     for key, value in response.items():
@@ -269,28 +441,68 @@ async def stream_generator(query: str, session: Session, recursion_limit: int =
                 "response": response.text(),
                 "metadata": metadata
             }
-            yield f"data: {json.dumps(response_data)}\n\n"
+            yield "message", response_data
+
+        if budget_tracker.exhausted_reason:
+            # Workers, team nodes and supervisors catch BudgetExhausted and wrap up with what they have,
+            # the messages streamed so far are the partial result
+            yield "budget_exhausted", budget_tracker.to_event()
 
         # After all data is sent, send end event
-        yield "event: end\ndata: Processing completed\n\n"
+        yield "end", "Processing completed"
+    except GraphRecursionError:
+        budget_tracker.exhausted_reason = "recursion_limit"
+        logger.warning(f"Recursion limit {recursion_limit} reached, returning partial result")
+        yield "budget_exhausted", budget_tracker.to_event()
+        yield "end", "Processing stopped: recursion limit reached"
     except Exception as e:
         error_msg = f"Error generating streaming response: {str(e)}"
         logger.error(error_msg, exc_info=True)
-        yield f"data: ERROR: {error_msg}\n\n"
+        yield "error", error_msg
         # Send end event even if error occurs, to notify client to close connection
-        yield f"event: end\ndata: Processing error: {str(e)}\n\n"
+        yield "end", f"Processing error: {str(e)}"
+    finally:
+        from speculation import discard_run as discard_speculations
+        from pipeline import discard_run as discard_pipelined_drafts
+
+        # Drop per-run state the session's graphs kept for this run
+        discard_speculations(timeline.run_id)
+        discard_pipelined_drafts(timeline.run_id)
+        timeline.finish()
+        if profiler is not None:
+            timeline.profile = profiler.stop()
+        if session_manager.cassette_recorder is not None:
+            session_manager.cassette.save()
+
+async def stream_generator(query: str, session: Session, recursion_limit: int = 150, limits: Optional[dict] = None,
+                           profile: bool = False):
+    """Async generator for streaming responses as Server-Sent Events"""
+    async for event_type, data in run_events(query, session, recursion_limit, limits, profile):
+        if event_type == "message":
+            yield f"data: {json.dumps(data)}\n\n"
+        elif event_type == "error":
+            yield f"data: ERROR: {data}\n\n"
+        else:
+            payload = data if isinstance(data, str) else json.dumps(data)
+            yield f"event: {event_type}\ndata: {payload}\n\n"
 
 @app.get("/query")
 async def query_agent_get(
     query: str = Query(..., description="User query"),
     recursion_limit: int = Query(150, description="Recursion limit"),
-    session_id: Optional[str] = None
+    session_id: Optional[str] = None,
+    max_seconds: Optional[float] = Query(None, description="Wall-clock budget in seconds"),
+    max_tokens: Optional[int] = Query(None, description="Total token budget"),
+    max_tool_calls: Optional[int] = Query(None, description="Tool call budget"),
+    max_cost: Optional[float] = Query(None, description="Estimated cost budget in USD"),
+    profile: bool = Query(False, description="Attach a sampling profile to the run timeline"),
 ):
     """Stream agent responses via GET request"""
     logger.info(f"API request: GET /query, query: {query}, recursion_limit: {recursion_limit}, session_id: {session_id}")
     session = await get_or_create_session(session_id)
+    limits = dict(max_seconds=max_seconds, max_tokens=max_tokens, max_tool_calls=max_tool_calls, max_cost=max_cost)
     return StreamingResponse(
-        stream_generator(query, session, recursion_limit),
+        stream_generator(query, session, recursion_limit, limits, profile),
         media_type="text/event-stream",
         headers={"X-Session-ID": session.id}
     )
@@ -300,12 +512,24 @@ async def query_agent_post(request: QueryRequest):
     """Stream agent responses via POST request"""
     logger.info(f"API request: POST /query, query: {request.query}, recursion_limit: {request.recursion_limit}, session_id: {request.session_id}")
     session = await get_or_create_session(request.session_id)
+    limits = dict(
+        max_seconds=request.max_seconds,
+        max_tokens=request.max_tokens,
+        max_tool_calls=request.max_tool_calls,
+        max_cost=request.max_cost,
+    )
     return StreamingResponse(
-        stream_generator(request.query, session, request.recursion_limit),
+        stream_generator(request.query, session, request.recursion_limit, limits, request.profile),
         media_type="text/event-stream",
         headers={"X-Session-ID": session.id}
     )
 
+@app.websocket("/ws")
+async def websocket_endpoint(websocket: WebSocket):
+    """Multiplexed binary transport for session handshakes, concurrent runs, file events and cancellation"""
+    logger.info("API request: WebSocket /ws")
+    await MultiplexedConnection(websocket, session_manager, run_events).serve()
+
 @app.get("/files")
 async def list_files(session_id: str):
     """Get list of files in working directory"""
@@ -317,15 +541,7 @@ async def list_files(session_id: str):
 
         session.update_last_used()
 
-        # Get all files in working directory
-        files = []
-        for file_path in session.working_dir.glob("**/*"):
-            if file_path.is_file():
-                # Return path relative to working directory
-                rel_path = file_path.relative_to(session.working_dir)
-                files.append(str(rel_path))
-
-        return FileListResponse(files=files, session_id=session_id)
+        return FileListResponse(files=session.list_files(), session_id=session_id)
     except Exception as e:
         logger.error(f"Error getting file list: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Error getting file list: {str(e)}")
@@ -369,6 +585,64 @@ async def download_file(session_id: str, file_path: str):
         logger.error(f"Error downloading file: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Error downloading file: {str(e)}")
 
+@app.get("/health")
+async def health():
+    """Liveness check, also reports whether LLM clients and tools are initialized"""
+    return {"status": "ok", "initialized": session_manager.initialized}
+
+@app.get("/stats/routing")
+async def get_routing_stats():
+    """Get how often each supervisor routing path (rule, classifier, llm) was taken"""
+    return routing_stats.snapshot()
+
+@app.get("/stats/search_cache")
+async def get_search_cache_stats():
+    """Get search cache hits, misses and coalesced in-flight queries"""
+    if session_manager.search_cache is None:
+        return {}
+    return session_manager.search_cache.stats()
+
+@app.get("/runs/{run_id}/timeline")
+async def get_run_timeline(
+    run_id: str,
+    format: str = Query("json", description="json, or chrome for Chrome trace-event JSON"),
+):
+    """Get the span timeline of a recent run, optionally as a Chrome trace (chrome://tracing, Perfetto)"""
+    from timeline import timeline_store
+
+    timeline = timeline_store.get(run_id)
+    if timeline is None:
+        raise HTTPException(status_code=404, detail=f"Run {run_id} does not exist or has been evicted")
+    if format == "chrome":
+        return JSONResponse(
+            content=timeline.to_chrome_trace(),
+            headers={"Content-Disposition": f'attachment; filename="{run_id}.trace.json"'},
+        )
+    if format != "json":
+        raise HTTPException(status_code=400, detail=f"Unsupported timeline format: {format}")
+    return timeline.to_dict()
+
+@app.get("/stats/speculation")
+async def get_speculation_stats():
+    """Get speculative first-hop hit rate and the time it saved or wasted"""
+    from speculation import speculation_stats
+
+    return speculation_stats.snapshot()
+
+@app.get("/stats/dispatcher")
+async def get_dispatcher_stats():
+    """Get LLM dispatcher queue waits, retries and per-endpoint rate limiting"""
+    if session_manager.model_pool is None:
+        return {}
+    return session_manager.model_pool.stats()
+
+@app.get("/stats/prompt_cache")
+async def get_prompt_cache_stats():
+    """Get input tokens and input tokens served from the provider's prompt cache, per graph node"""
+    from timeline import prompt_cache_stats
+
+    return prompt_cache_stats.snapshot()
+
 # If this file is run directly, start API server
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,176 @@
+# coding: utf-8
+"""Dispatcher exercise against the stub provider's per-key rate limits
+
+Starts stub_provider.py with per-key request and token limits and builds a
+ModelPool whose router and writer specs share two endpoints, one per stub API
+key, declaring the same limits. It then fires router (structured output),
+worker and writer calls at once, half of them sync and half async, and
+reports:
+  - per key: requests the stub admitted and 429s it answered
+  - dispatcher retries and the average queue wait per priority
+
+Exits with code 1 if a call failed or routers waited longer than writers on
+average. Run from the backend directory, e.g.
+`python bench_dispatch.py --calls 60 --rpm 30 --json`.
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import subprocess
+import urllib.request
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from typing_extensions import TypedDict
+
+BACKEND_DIR = Path(__file__).resolve().parent
+STUB_KEYS = {"STUB_KEY_1": "sk-stub-1", "STUB_KEY_2": "sk-stub-2"}
+# Node of each call kind, which decides its dispatch priority
+CALL_NODES = {
+    "router": "super_team.supervisor",
+    "worker": "research_team.search",
+    "writer": "writing_team.doc_writer",
+}
+
+
+class Router(TypedDict):
+    next: str
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_stub(port: int, rpm: float, tpm: float, latency: float, timeout: float = 30.0) -> subprocess.Popen:
+    process = subprocess.Popen(
+        [sys.executable, "stub_provider.py", "--port", str(port), "--rpm", str(rpm), "--tpm", str(tpm),
+         "--latency", str(latency)],
+        cwd=BACKEND_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    started = time.perf_counter()
+    while time.perf_counter() - started < timeout:
+        if process.poll() is not None:
+            raise RuntimeError(f"stub_provider exited with code {process.returncode}")
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/stats", timeout=1):
+                return process
+        except OSError:
+            time.sleep(0.05)
+    process.terminate()
+    raise TimeoutError(f"Stub provider not ready after {timeout} seconds")
+
+
+def stub_stats(port: int) -> dict:
+    with urllib.request.urlopen(f"http://127.0.0.1:{port}/stats", timeout=5) as response:
+        return json.loads(response.read())
+
+
+def build_pool(port: int, rpm: float, tpm: float):
+    from models import ModelPool
+
+    endpoints = [
+        {"base_url": f"http://127.0.0.1:{port}/v1", "api_key_env": env, "rpm": rpm, "tpm": tpm}
+        for env in STUB_KEYS
+    ]
+    return ModelPool({
+        "models": {
+            "router": {"model": "stub-router", "temperature": 0, "endpoints": endpoints},
+            "writer": {"model": "stub-writer", "endpoints": endpoints},
+        },
+        "nodes": {"supervisor": "router"},
+        "default": "writer",
+    })
+
+
+def _call(pool, kind: str):
+    llm = pool.for_node(CALL_NODES[kind])
+    if kind == "router":
+        return llm.with_structured_output(Router).invoke("Route this task.")
+    return llm.invoke(f"Answer as the {kind}.")
+
+
+async def _acall(pool, kind: str):
+    llm = pool.for_node(CALL_NODES[kind])
+    if kind == "router":
+        return await llm.with_structured_output(Router).ainvoke("Route this task.")
+    return await llm.ainvoke(f"Answer as the {kind}.")
+
+
+def run_calls(pool, calls: int) -> dict:
+    """Fire `calls` calls at once, spread over the kinds, alternating sync and async"""
+    kinds = [list(CALL_NODES)[index % len(CALL_NODES)] for index in range(calls)]
+    sync_kinds, async_kinds = kinds[0::2], kinds[1::2]
+    failures = []
+
+    async def run_async():
+        results = await asyncio.gather(*(_acall(pool, kind) for kind in async_kinds), return_exceptions=True)
+        failures.extend(str(result) for result in results if isinstance(result, BaseException))
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, len(sync_kinds))) as executor:
+        futures = [executor.submit(_call, pool, kind) for kind in sync_kinds]
+        asyncio.run(run_async())
+        for future in futures:
+            try:
+                future.result()
+            except Exception as e:
+                failures.append(str(e))
+    return {"seconds": round(time.perf_counter() - started, 3), "failures": failures}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Exercise the LLM dispatcher against rate-limited stub keys")
+    parser.add_argument("--calls", type=int, default=60, help="Calls fired at once")
+    parser.add_argument("--rpm", type=float, default=30, help="Requests per minute per stub API key")
+    parser.add_argument("--tpm", type=float, default=60000, help="Tokens per minute per stub API key")
+    parser.add_argument("--latency", type=float, default=0.05, help="Stub answer latency in seconds")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+
+    os.environ.update(STUB_KEYS)
+    port = _free_port()
+    stub = start_stub(port, args.rpm, args.tpm, args.latency)
+    try:
+        pool = build_pool(port, args.rpm, args.tpm)
+        run = run_calls(pool, args.calls)
+        provider = stub_stats(port)
+    finally:
+        stub.terminate()
+        try:
+            stub.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            stub.kill()
+
+    dispatcher = pool.stats()
+    results = {
+        "calls": args.calls,
+        "seconds": run["seconds"],
+        "failures": run["failures"],
+        "keys": {key: provider.get(key, {"requests": 0, "rate_limited": 0}) for key in STUB_KEYS.values()},
+        "retries": dispatcher["retries"],
+        "queue_wait": dispatcher["queue_wait"],
+    }
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"{args.calls} calls in {run['seconds']:.2f}s, {len(run['failures'])} failed, "
+              f"{dispatcher['retries']} retried")
+        for key, counts in results["keys"].items():
+            print(f"  {key}: {counts['requests']} requests, {counts['rate_limited']} answered 429")
+        for priority, wait in results["queue_wait"].items():
+            print(f"  priority {priority}: {wait['calls']} calls, {wait['avg_seconds']:.3f}s average queue wait")
+
+    # Averages ordered from routers to writers
+    waits = [wait["avg_seconds"] for _, wait in sorted(dispatcher["queue_wait"].items())]
+    if run["failures"] or (waits and waits[0] > waits[-1]):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+# coding: utf-8
+"""Startup-time benchmark
+
+Measures, each in a fresh interpreter:
+  - import time of the `api` module
+  - `python main.py --help` time
+  - ready-to-serve latency: from launching uvicorn until GET /health answers
+
+Run from the backend directory, e.g. `python bench_startup.py --repeat 5 --json`.
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import statistics
+import subprocess
+import urllib.request
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent
+
+
+def _env():
+    env = dict(os.environ)
+    # Never block on key prompts and don't warm up LLM clients while measuring readiness
+    env.setdefault("OPENAI_API_KEY", "sk-benchmark")
+    env.setdefault("TAVILY_API_KEY", "tvly-benchmark")
+    env.setdefault("AGENT_EAGER_INIT", "0")
+    return env
+
+
+def _timed_run(args) -> float:
+    started = time.perf_counter()
+    subprocess.run(args, cwd=BACKEND_DIR, env=_env(), check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - started
+
+
+def measure_import(module: str = "api") -> float:
+    return _timed_run([sys.executable, "-c", f"import {module}"])
+
+
+def measure_cli_help() -> float:
+    return _timed_run([sys.executable, "main.py", "--help"])
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def measure_ready_to_serve(timeout: float = 60.0) -> float:
+    port = _free_port()
+    url = f"http://127.0.0.1:{port}/health"
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "api:app", "--host", "127.0.0.1", "--port", str(port)],
+        cwd=BACKEND_DIR, env=_env(), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        while time.perf_counter() - started < timeout:
+            if process.poll() is not None:
+                raise RuntimeError(f"uvicorn exited with code {process.returncode}")
+            try:
+                with urllib.request.urlopen(url, timeout=1) as response:
+                    if response.status == 200:
+                        return time.perf_counter() - started
+            except OSError:
+                time.sleep(0.02)
+        raise TimeoutError(f"Server not ready after {timeout} seconds")
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def top_imports(module: str = "api", limit: int = 15) -> list:
+    """Slowest imports by cumulative time, from `python -X importtime`"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=BACKEND_DIR, env=_env(), capture_output=True, text=True,
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        # Format: "import time: <self us> | <cumulative us> | <module>"
+        _, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        rows.append((int(cumulative_us), name.strip()))
+    rows.sort(reverse=True)
+    return [{"module": name, "cumulative_ms": round(us / 1000, 1)} for us, name in rows[:limit]]
+
+
+def _summary(samples: list) -> dict:
+    return {
+        "median_s": round(statistics.median(samples), 4),
+        "min_s": round(min(samples), 4),
+        "max_s": round(max(samples), 4),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure backend startup latency")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per measurement")
+    parser.add_argument("--skip-server", action="store_true", help="Skip the ready-to-serve measurement")
+    parser.add_argument("--importtime", action="store_true", help="Also report the slowest imports")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+
+    results = {
+        "import_api": _summary([measure_import() for _ in range(args.repeat)]),
+        "cli_help": _summary([measure_cli_help() for _ in range(args.repeat)]),
+    }
+    if not args.skip_server:
+        results["ready_to_serve"] = _summary([measure_ready_to_serve() for _ in range(args.repeat)])
+    if args.importtime:
+        results["top_imports"] = top_imports()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for name, value in results.items():
+        if name == "top_imports":
+            print("slowest imports:")
+            for row in value:
+                print(f"  {row['cumulative_ms']:>9.1f} ms  {row['module']}")
+        else:
+            print(f"{name:<16} median {value['median_s']:.3f}s  (min {value['min_s']:.3f}s, max {value['max_s']:.3f}s)")
+
+
+if __name__ == "__main__":
+    main()
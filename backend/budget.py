@@ -0,0 +1,233 @@
+# coding: utf-8
+
+import os
+import time
+import logging
+import threading
+from typing import Any, Dict, Optional
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+
+logger = logging.getLogger(__name__)
+
+# USD per 1M (input, output) tokens, used to estimate the cost of a run
+MODEL_PRICING = {
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4.1": (2.00, 8.00),
+    "gpt-4.1-mini": (0.40, 1.60),
+    "gpt-4.1-nano": (0.10, 0.40),
+}
+DEFAULT_PRICING = MODEL_PRICING["gpt-4o"]
+
+# Share of any budget after which supervisors are asked to wrap up
+WRAP_UP_THRESHOLD = 0.8
+
+BUDGET_LIMITS = ("max_seconds", "max_tokens", "max_tool_calls", "max_cost")
+
+
+def _min_limit(a, b):
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return min(a, b)
+
+
+def _env_number(var: str, cast):
+    value = os.environ.get(var)
+    if value is None or value.strip() == "":
+        return None
+    try:
+        return cast(value)
+    except ValueError:
+        logger.warning(f"Ignoring invalid value for {var}: {value}")
+        return None
+
+
+class BudgetExhausted(Exception):
+    """Raised by the tracker when an LLM or tool call starts after the budget ran out"""
+
+    def __init__(self, reason: str):
+        super().__init__(f"Run budget exhausted: {reason}")
+        self.reason = reason
+
+
+class RunBudget:
+    """Limits for a single run, None means unlimited"""
+
+    def __init__(
+        self,
+        max_seconds: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+        max_tool_calls: Optional[int] = None,
+        max_cost: Optional[float] = None,
+    ):
+        self.max_seconds = max_seconds
+        self.max_tokens = max_tokens
+        self.max_tool_calls = max_tool_calls
+        self.max_cost = max_cost
+
+    @classmethod
+    def from_env(cls) -> "RunBudget":
+        """Server-wide caps, configured via AGENT_MAX_RUN_* environment variables"""
+        return cls(
+            max_seconds=_env_number("AGENT_MAX_RUN_SECONDS", float),
+            max_tokens=_env_number("AGENT_MAX_RUN_TOKENS", int),
+            max_tool_calls=_env_number("AGENT_MAX_RUN_TOOL_CALLS", int),
+            max_cost=_env_number("AGENT_MAX_RUN_COST", float),
+        )
+
+    def capped(self, caps: "RunBudget") -> "RunBudget":
+        """Return a budget where every limit is at most the corresponding cap"""
+        return RunBudget(**{
+            name: _min_limit(getattr(self, name), getattr(caps, name))
+            for name in BUDGET_LIMITS
+        })
+
+    def is_unlimited(self) -> bool:
+        return all(getattr(self, name) is None for name in BUDGET_LIMITS)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in BUDGET_LIMITS}
+
+
+class BudgetTracker(BaseCallbackHandler):
+    """Callback handler accumulating the usage of a run and checking it against a budget
+
+    Supervisors look the tracker up through `get_budget_tracker(config)` and stop
+    routing to workers once the budget is exhausted, so the run ends with the
+    partial results gathered so far instead of an error. Inside a worker's own
+    agent loop, the next LLM or tool call raises `BudgetExhausted`; workers
+    catch it and report what they have.
+    """
+
+    # Let BudgetExhausted propagate out of the callback into the agent loop
+    raise_error = True
+
+    def __init__(self, budget: RunBudget):
+        self.budget = budget
+        self.started_at = time.monotonic()
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.tool_calls = 0
+        self.cost = 0.0
+        self.exhausted_reason: Optional[str] = None
+        self._lock = threading.Lock()
+        # Per LLM run: (model name, estimated input tokens) for when usage is not reported
+        self._pending: Dict[UUID, tuple] = {}
+
+    @property
+    def total_tokens(self) -> int:
+        return self.input_tokens + self.output_tokens
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started_at
+
+    def on_chat_model_start(self, serialized, messages, *, run_id: UUID, metadata=None, **kwargs: Any):
+        self._raise_if_exhausted()
+        model = (metadata or {}).get("ls_model_name") or ""
+        estimated = sum(len(str(m.content)) for batch in messages for m in batch) // 4
+        with self._lock:
+            self._pending[run_id] = (model, estimated)
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any):
+        with self._lock:
+            model, estimated_input = self._pending.pop(run_id, ("", 0))
+        model = (response.llm_output or {}).get("model_name") or model
+
+        input_tokens = output_tokens = 0
+        reported = False
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                if usage:
+                    reported = True
+                    input_tokens += usage.get("input_tokens", 0)
+                    output_tokens += usage.get("output_tokens", 0)
+                else:
+                    output_tokens += len(generation.text) // 4
+        if not reported:
+            input_tokens = estimated_input
+
+        input_price, output_price = self._pricing(model)
+        with self._lock:
+            self.input_tokens += input_tokens
+            self.output_tokens += output_tokens
+            self.cost += (input_tokens * input_price + output_tokens * output_price) / 1_000_000
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any):
+        with self._lock:
+            self._pending.pop(run_id, None)
+
+    def on_tool_start(self, serialized, input_str: str, **kwargs: Any):
+        self._raise_if_exhausted()
+        with self._lock:
+            self.tool_calls += 1
+
+    @staticmethod
+    def _pricing(model: str) -> tuple:
+        # Match the longest known prefix, e.g. "gpt-4o-2024-11-20" -> "gpt-4o"
+        for name in sorted(MODEL_PRICING, key=len, reverse=True):
+            if model.startswith(name):
+                return MODEL_PRICING[name]
+        return DEFAULT_PRICING
+
+    def _usage_ratios(self) -> Dict[str, float]:
+        used = {
+            "max_seconds": self.elapsed,
+            "max_tokens": self.total_tokens,
+            "max_tool_calls": self.tool_calls,
+            "max_cost": self.cost,
+        }
+        return {
+            name: used[name] / limit if limit else float("inf")
+            for name in BUDGET_LIMITS
+            if (limit := getattr(self.budget, name)) is not None
+        }
+
+    def check(self) -> Optional[str]:
+        """Return the name of the exhausted limit, or None while within budget"""
+        if self.exhausted_reason is None:
+            for name, ratio in self._usage_ratios().items():
+                if ratio >= 1:
+                    self.exhausted_reason = name
+                    logger.warning(f"Run budget exhausted: {name}, usage: {self.usage()}")
+                    break
+        return self.exhausted_reason
+
+    def _raise_if_exhausted(self):
+        reason = self.check()
+        if reason is not None:
+            raise BudgetExhausted(reason)
+
+    def should_wrap_up(self) -> bool:
+        """True once any limit is close to being reached"""
+        return any(ratio >= WRAP_UP_THRESHOLD for ratio in self._usage_ratios().values())
+
+    def usage(self) -> Dict[str, Any]:
+        return {
+            "seconds": round(self.elapsed, 3),
+            "input_tokens": self.input_tokens,
+            "output_tokens": self.output_tokens,
+            "total_tokens": self.total_tokens,
+            "tool_calls": self.tool_calls,
+            "cost": round(self.cost, 6),
+        }
+
+    def to_event(self) -> Dict[str, Any]:
+        return {
+            "reason": self.exhausted_reason,
+            "budget": self.budget.to_dict(),
+            "usage": self.usage(),
+        }
+
+
+def get_budget_tracker(config: Optional[dict]) -> Optional[BudgetTracker]:
+    """Get the tracker of the current run from a runnable config"""
+    if not config:
+        return None
+    return config.get("configurable", {}).get("budget_tracker")
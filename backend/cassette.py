@@ -0,0 +1,332 @@
+# coding: utf-8
+"""Record and replay LLM and tool interactions
+
+Recording attaches a `CassetteRecorder` callback to a run. It captures every
+chat model request and response, including the timing of streamed chunks, and
+every tool call, into a gzipped JSON-lines cassette. Replaying swaps the chat
+model for `ReplayChatModel` and the network tools for `ReplayTool`, which
+answer from the cassette either at the recorded speed or with zero latency, so
+orchestration changes can be compared offline and deterministically.
+
+Responses are looked up by a hash of the request (messages, or tool name and
+arguments). When a request has no exact match, for example because the code
+under test changed a prompt, the next unused entry of the same kind and name
+is returned in recorded order.
+"""
+
+import os
+import gzip
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import defaultdict, deque
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+from uuid import UUID
+
+from pydantic import BaseModel, ConfigDict
+from langchain_core.callbacks import BaseCallbackHandler, CallbackManagerForLLMRun, CallbackManagerForToolRun
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.messages import message_chunk_to_message, message_to_dict, messages_from_dict
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult, LLMResult
+from langchain_core.runnables import RunnableLambda
+from langchain_core.tools import BaseTool
+from langchain_core.utils.function_calling import convert_to_openai_tool
+
+logger = logging.getLogger(__name__)
+
+CASSETTE_VERSION = 1
+REPLAY_SPEEDS = ("recorded", "zero")
+
+
+def _hash(value: Any) -> str:
+    encoded = json.dumps(value, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()[:24]
+
+
+def llm_request_key(messages: List[BaseMessage]) -> str:
+    """Hash of the parts of a request that determine the response, ids excluded"""
+    parts = []
+    for message in messages:
+        content = message.content if isinstance(message.content, str) else json.dumps(message.content, default=str)
+        tool_calls = [(call["name"], call["args"]) for call in getattr(message, "tool_calls", None) or []]
+        parts.append([message.type, getattr(message, "name", None) or "", content, tool_calls])
+    return _hash(parts)
+
+
+def tool_request_key(name: str, inputs: Any) -> str:
+    return _hash([name, inputs])
+
+
+def _tool_output_to_text(output: Any) -> str:
+    content = getattr(output, "content", output)
+    if isinstance(content, str):
+        return content
+    return json.dumps(content, ensure_ascii=False, default=str)
+
+
+class Cassette:
+    """Recorded interactions, stored as gzipped JSON lines"""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.entries: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+        self._used: set = set()
+        self._by_key: Dict[tuple, deque] = defaultdict(deque)
+        self._by_name: Dict[tuple, deque] = defaultdict(deque)
+
+    @classmethod
+    def load(cls, path: Path) -> "Cassette":
+        cassette = cls(path)
+        with gzip.open(path, "rt", encoding="utf-8") as file:
+            header = json.loads(file.readline())
+            if header.get("version") != CASSETTE_VERSION:
+                raise ValueError(f"Unsupported cassette version: {header.get('version')}")
+            for line in file:
+                if line.strip():
+                    cassette._index(json.loads(line))
+        logger.info(f"Loaded cassette {path} with {len(cassette.entries)} entries")
+        return cassette
+
+    def _index(self, entry: Dict[str, Any]):
+        position = len(self.entries)
+        self.entries.append(entry)
+        self._by_key[(entry["kind"], entry["key"])].append(position)
+        self._by_name[(entry["kind"], entry.get("name", ""))].append(position)
+
+    def add(self, entry: Dict[str, Any]):
+        with self._lock:
+            self._index(entry)
+
+    def save(self):
+        with self._lock:
+            entries = list(self.entries)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(".tmp")
+        with gzip.open(tmp_path, "wt", encoding="utf-8") as file:
+            file.write(json.dumps({"version": CASSETTE_VERSION, "created_at": time.time()}) + "\n")
+            for entry in entries:
+                file.write(json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n")
+        os.replace(tmp_path, self.path)
+        logger.info(f"Saved cassette {self.path} with {len(entries)} entries")
+
+    def _pop_unused(self, positions: deque) -> Optional[int]:
+        while positions:
+            position = positions.popleft()
+            if position not in self._used:
+                return position
+        return None
+
+    def take(self, kind: str, key: str, name: str = "") -> Optional[Dict[str, Any]]:
+        """Return the next unused entry matching `key`, else the next one of the same kind and name"""
+        with self._lock:
+            position = self._pop_unused(self._by_key[(kind, key)])
+            if position is None:
+                position = self._pop_unused(self._by_name[(kind, name)])
+                if position is not None:
+                    logger.warning(f"No exact cassette match for {kind} {name or ''}, replaying in recorded order")
+            if position is None:
+                return None
+            self._used.add(position)
+            return self.entries[position]
+
+
+class CassetteRecorder(BaseCallbackHandler):
+    """Callback handler writing every chat model and tool interaction of a run to a cassette"""
+
+    def __init__(self, cassette: Cassette):
+        self.cassette = cassette
+        self._lock = threading.Lock()
+        self._llm_runs: Dict[UUID, Dict[str, Any]] = {}
+        self._tool_runs: Dict[UUID, Dict[str, Any]] = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id: UUID, metadata=None, **kwargs: Any):
+        with self._lock:
+            self._llm_runs[run_id] = {
+                "kind": "llm",
+                "key": llm_request_key(messages[0]),
+                "name": "",
+                "model": (metadata or {}).get("ls_model_name", ""),
+                "started_at": time.monotonic(),
+                "chunks": [],
+            }
+
+    def on_llm_new_token(self, token: str, *, run_id: UUID, **kwargs: Any):
+        with self._lock:
+            run = self._llm_runs.get(run_id)
+            if run is not None and token:
+                run["chunks"].append([round(time.monotonic() - run["started_at"], 4), token])
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any):
+        with self._lock:
+            run = self._llm_runs.pop(run_id, None)
+        if run is None:
+            return
+        message = response.generations[0][0].message
+        if isinstance(message, AIMessageChunk):
+            message = message_chunk_to_message(message)
+        run["latency"] = round(time.monotonic() - run.pop("started_at"), 4)
+        run["response"] = message_to_dict(message)
+        self.cassette.add(run)
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any):
+        with self._lock:
+            self._llm_runs.pop(run_id, None)
+
+    def on_tool_start(self, serialized, input_str: str, *, run_id: UUID, inputs=None, **kwargs: Any):
+        name = kwargs.get("name") or (serialized or {}).get("name", "")
+        arguments = inputs if inputs is not None else input_str
+        with self._lock:
+            self._tool_runs[run_id] = {
+                "kind": "tool",
+                "key": tool_request_key(name, arguments),
+                "name": name,
+                "input": arguments,
+                "started_at": time.monotonic(),
+            }
+
+    def on_tool_end(self, output: Any, *, run_id: UUID, **kwargs: Any):
+        with self._lock:
+            run = self._tool_runs.pop(run_id, None)
+        if run is None:
+            return
+        run["latency"] = round(time.monotonic() - run.pop("started_at"), 4)
+        run["output"] = _tool_output_to_text(output)
+        self.cassette.add(run)
+
+    def on_tool_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any):
+        with self._lock:
+            self._tool_runs.pop(run_id, None)
+
+
+class ReplayChatModel(BaseChatModel):
+    """Chat model answering from a cassette instead of calling a provider"""
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    cassette: Cassette
+    speed: str = "zero"
+
+    @property
+    def _llm_type(self) -> str:
+        return "cassette-replay"
+
+    def _take(self, messages: List[BaseMessage]) -> Dict[str, Any]:
+        entry = self.cassette.take("llm", llm_request_key(messages))
+        if entry is None:
+            raise LookupError("Cassette has no more recorded LLM responses")
+        return entry
+
+    @staticmethod
+    def _message(entry: Dict[str, Any]) -> AIMessage:
+        return messages_from_dict([entry["response"]])[0]
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        entry = self._take(messages)
+        if self.speed == "recorded":
+            time.sleep(entry.get("latency", 0))
+        return ChatResult(generations=[ChatGeneration(message=self._message(entry))])
+
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        entry = self._take(messages)
+        message = self._message(entry)
+        elapsed = 0.0
+        for offset, text in entry.get("chunks", []):
+            if self.speed == "recorded" and offset > elapsed:
+                time.sleep(offset - elapsed)
+                elapsed = offset
+            yield ChatGenerationChunk(message=AIMessageChunk(content=text))
+        if self.speed == "recorded" and entry.get("latency", 0) > elapsed:
+            time.sleep(entry["latency"] - elapsed)
+        # The last chunk carries what is not plain text: tool calls, usage and metadata
+        streamed_text = "".join(text for _, text in entry.get("chunks", []))
+        remaining = message.content if isinstance(message.content, str) and not streamed_text else ""
+        yield ChatGenerationChunk(message=AIMessageChunk(
+            content=remaining,
+            tool_call_chunks=[
+                {"name": call["name"], "args": json.dumps(call["args"]), "id": call["id"], "index": index}
+                for index, call in enumerate(message.tool_calls)
+            ],
+            usage_metadata=message.usage_metadata,
+            response_metadata=message.response_metadata,
+        ))
+
+    def bind_tools(self, tools, *, tool_choice=None, **kwargs: Any):
+        formatted_tools = [convert_to_openai_tool(tool) for tool in tools]
+        if tool_choice is not None:
+            kwargs["tool_choice"] = tool_choice
+        return self.bind(tools=formatted_tools, **kwargs)
+
+    def with_structured_output(self, schema, *, include_raw: bool = False, **kwargs: Any):
+        """Parse recorded structured output, whether it was produced with tool calling or JSON mode"""
+
+        def parse(message: AIMessage):
+            if message.tool_calls:
+                parsed = message.tool_calls[0]["args"]
+            elif "parsed" in message.additional_kwargs:
+                parsed = message.additional_kwargs["parsed"]
+            else:
+                parsed = json.loads(message.content)
+            if isinstance(schema, type) and issubclass(schema, BaseModel) and isinstance(parsed, dict):
+                return schema(**parsed)
+            return parsed
+
+        return self | RunnableLambda(parse)
+
+
+class ReplayTool(BaseTool):
+    """Tool answering from a cassette, with the name and arguments of the tool it stands in for"""
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    cassette: Cassette
+    speed: str = "zero"
+
+    @classmethod
+    def from_tool(cls, tool: BaseTool, cassette: Cassette, speed: str = "zero") -> "ReplayTool":
+        return cls(
+            name=tool.name,
+            description=tool.description,
+            args_schema=tool.args_schema,
+            cassette=cassette,
+            speed=speed,
+        )
+
+    def _run(self, run_manager: Optional[CallbackManagerForToolRun] = None, **kwargs: Any) -> str:
+        entry = self.cassette.take("tool", tool_request_key(self.name, kwargs), self.name)
+        if entry is None:
+            return f"Error: no recorded output for {self.name}"
+        if self.speed == "recorded":
+            time.sleep(entry.get("latency", 0))
+        return entry["output"]
+
+
+def cassette_settings_from_env() -> Dict[str, Optional[str]]:
+    """Read AGENT_CASSETTE_MODE (record or replay), AGENT_CASSETTE_PATH and AGENT_REPLAY_SPEED"""
+    mode = os.environ.get("AGENT_CASSETTE_MODE") or None
+    if mode not in (None, "record", "replay"):
+        raise ValueError(f"Invalid AGENT_CASSETTE_MODE: {mode}")
+    speed = os.environ.get("AGENT_REPLAY_SPEED", "zero")
+    if speed not in REPLAY_SPEEDS:
+        raise ValueError(f"Invalid AGENT_REPLAY_SPEED: {speed}")
+    return {
+        "mode": mode,
+        "path": os.environ.get("AGENT_CASSETTE_PATH", "agent_run.cassette.jsonl.gz"),
+        "speed": speed,
+    }
@@ -2,12 +2,41 @@
 
 import os
 import getpass
+import logging
+
+logger = logging.getLogger(__name__)
+
+REQUIRED_ENV_VARS = ["OPENAI_API_KEY", "TAVILY_API_KEY"]
 
 def _set_if_undefined(var: str):
     if not os.environ.get(var):
         os.environ[var] = getpass.getpass(f"Please provide your {var}:")
 
-def setup_environment():
+def setup_environment(interactive: bool = True) -> list:
+    """Make sure the API keys are set, returns the names of the ones still missing
+
+    In interactive mode (CLI) missing keys are prompted for. Otherwise (API server)
+    they are read from the environment or a `.env` file and never block on input.
+    """
+    if not interactive:
+        try:
+            from dotenv import load_dotenv
+            load_dotenv()
+        except ImportError:
+            pass
+        missing = [var for var in REQUIRED_ENV_VARS if not os.environ.get(var)]
+        if missing:
+            logger.warning(f"Missing environment variables: {', '.join(missing)}")
+        return missing
+
     _set_if_undefined("OPENAI_API_KEY")
     # _set_if_undefined("OPENROUTER_API_KEY")
     _set_if_undefined("TAVILY_API_KEY")
+    return []
+
+def env_flag(var: str, default: bool = False) -> bool:
+    """Read a boolean switch from the environment"""
+    value = os.environ.get(var)
+    if value is None or value.strip() == "":
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
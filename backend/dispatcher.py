@@ -0,0 +1,496 @@
+# coding: utf-8
+"""Rate-limit-aware dispatch of LLM calls
+
+Every call of a `DispatchedChatModel` goes through an `LLMDispatcher` shared
+by all models of a pool. A model may use one or more endpoints (API key and
+base URL pairs); models configured with the same key and base URL share the
+endpoint and its request and token rate budgets, tracked with token buckets.
+Calls competing for an endpoint are served in priority order, routers before
+research workers before writers, and each is sent to the usable endpoint with
+the most headroom. A rate-limited (429) call puts its endpoint into a
+cool-down, honoring Retry-After or else a jittered exponential backoff, and is
+queued again at its original place so it can go to another endpoint in the
+meantime. Sync calls wait on a condition, async calls (`ainvoke`, `astream`)
+wait without blocking the event loop and keep the same queue order.
+"""
+
+import time
+import asyncio
+import random
+import logging
+import itertools
+import threading
+from typing import Any, AsyncIterator, Dict, FrozenSet, Iterator, List, Optional
+
+from pydantic import ConfigDict
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatGenerationChunk, ChatResult
+from langchain_core.utils.function_calling import convert_to_openai_tool
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_ROUTER = 0
+PRIORITY_WORKER = 1
+PRIORITY_WRITER = 2
+
+NODE_PRIORITIES = {
+    "supervisor": PRIORITY_ROUTER,
+    "doc_writer": PRIORITY_WRITER,
+    "note_taker": PRIORITY_WRITER,
+    "chart_generator": PRIORITY_WRITER,
+}
+
+# Status codes retried through the dispatcher, everything else is raised to the caller
+RETRYABLE_STATUS_CODES = (429, 503)
+# Output tokens reserved per call before the actual usage is known
+DEFAULT_OUTPUT_TOKENS = 512
+# How often an async call waiting in the queue checks whether it may go
+ASYNC_POLL_SECONDS = 0.05
+
+
+def priority_for_node(node: str) -> int:
+    """Dispatch priority of a "<team>.<node>" graph node"""
+    return NODE_PRIORITIES.get(node.rsplit(".", 1)[-1], PRIORITY_WORKER)
+
+
+def estimate_request_tokens(messages: List[BaseMessage]) -> int:
+    return sum(len(str(message.content)) for message in messages) // 4 + DEFAULT_OUTPUT_TOKENS
+
+
+class TokenBucket:
+    """Continuously refilled budget of `per_minute` units, None means unlimited"""
+
+    def __init__(self, per_minute: Optional[float]):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0 if per_minute else None
+        self.available = per_minute or 0.0
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        if self.rate is None:
+            return
+        self.available = min(self.capacity, self.available + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until `amount` can be taken, requests larger than the bucket wait for a full bucket"""
+        if self.rate is None:
+            return 0.0
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        return 0.0 if self.available >= amount else (amount - self.available) / self.rate
+
+    def take(self, amount: float, now: float):
+        if self.rate is None:
+            return
+        self._refill(now)
+        # May go negative, later calls then wait until the debt is paid off
+        self.available -= amount
+
+    def give_back(self, amount: float):
+        if self.rate is None:
+            return
+        self.available = min(self.capacity, self.available + amount)
+
+    def fill_ratio(self, now: float) -> float:
+        if self.rate is None:
+            return 1.0
+        self._refill(now)
+        return max(0.0, self.available / self.capacity)
+
+
+class Endpoint:
+    """One API key and base URL with its request (rpm) and token (tpm) rate budgets"""
+
+    def __init__(self, name: str, rpm: Optional[float] = None, tpm: Optional[float] = None):
+        self.name = name
+        self.request_bucket = TokenBucket(rpm)
+        self.token_bucket = TokenBucket(tpm)
+        self.cooldown_until = 0.0
+        self.in_flight = 0
+        self.requests = 0
+        self.rate_limited = 0
+
+    def tighten(self, rpm: Optional[float] = None, tpm: Optional[float] = None):
+        """Apply budgets declared by another model using this endpoint, the smallest one wins"""
+        if rpm is not None and (self.request_bucket.capacity is None or rpm < self.request_bucket.capacity):
+            self.request_bucket = TokenBucket(rpm)
+        if tpm is not None and (self.token_bucket.capacity is None or tpm < self.token_bucket.capacity):
+            self.token_bucket = TokenBucket(tpm)
+
+    def wait_time(self, tokens: int, now: float) -> float:
+        return max(
+            self.cooldown_until - now,
+            self.request_bucket.wait_time(1, now),
+            self.token_bucket.wait_time(tokens, now),
+        )
+
+    def headroom(self, now: float) -> float:
+        return min(self.request_bucket.fill_ratio(now), self.token_bucket.fill_ratio(now)) - 0.01 * self.in_flight
+
+    def stats(self, now: float) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "requests": self.requests,
+            "rate_limited": self.rate_limited,
+            "in_flight": self.in_flight,
+            "cooldown": round(max(0.0, self.cooldown_until - now), 3),
+        }
+
+
+class LLMDispatcher:
+    """Queues LLM calls by priority and spreads them over rate-limited endpoints
+
+    Each call names the endpoints it may use. Among waiting calls that share
+    an endpoint, the one with the smallest (priority, sequence) ticket goes
+    first; calls with disjoint endpoints do not hold each other up.
+    """
+
+    def __init__(self, endpoints: Optional[List[Endpoint]] = None, max_retries: int = 6,
+                 base_backoff: float = 0.5, max_backoff: float = 30.0):
+        self.endpoints: List[Endpoint] = list(endpoints or [])
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        # Waiting tickets and the endpoints each may use
+        self._waiting: Dict[tuple, FrozenSet[Endpoint]] = {}
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._retries = 0
+        self._queue_wait: Dict[int, List[float]] = {}
+
+    def add_endpoint(self, endpoint: Endpoint):
+        with self._condition:
+            self.endpoints.append(endpoint)
+
+    def ticket(self, priority: int) -> tuple:
+        """Place of a call in the queue, kept across its retries"""
+        return priority, next(self._sequence)
+
+    def acquire(self, priority: int, tokens: int, endpoints: Optional[List[Endpoint]] = None,
+                ticket: Optional[tuple] = None) -> Endpoint:
+        """Block until this call may be sent, returns the endpoint to send it to
+
+        `endpoints` defaults to all endpoints. A retried call passes the ticket
+        of its first attempt so it does not go to the back of its priority class.
+        """
+        endpoints = list(endpoints or self.endpoints)
+        if not endpoints:
+            raise ValueError("LLMDispatcher needs at least one endpoint")
+        ticket = ticket or self.ticket(priority)
+        enqueued = time.monotonic()
+        with self._condition:
+            self._waiting[ticket] = frozenset(endpoints)
+            try:
+                while True:
+                    endpoint, timeout = self._try_take(ticket, endpoints, tokens, enqueued)
+                    if endpoint is not None:
+                        return endpoint
+                    self._condition.wait(timeout)
+            except BaseException:
+                self._leave(ticket)
+                raise
+
+    async def acquire_async(self, priority: int, tokens: int, endpoints: Optional[List[Endpoint]] = None,
+                            ticket: Optional[tuple] = None) -> Endpoint:
+        """`acquire` for async callers, waits without blocking the event loop"""
+        endpoints = list(endpoints or self.endpoints)
+        if not endpoints:
+            raise ValueError("LLMDispatcher needs at least one endpoint")
+        ticket = ticket or self.ticket(priority)
+        enqueued = time.monotonic()
+        with self._condition:
+            self._waiting[ticket] = frozenset(endpoints)
+        try:
+            while True:
+                with self._condition:
+                    endpoint, timeout = self._try_take(ticket, endpoints, tokens, enqueued)
+                if endpoint is not None:
+                    return endpoint
+                # Not notified like the sync waiters, so check again shortly
+                await asyncio.sleep(min(timeout, ASYNC_POLL_SECONDS))
+        except BaseException:
+            with self._condition:
+                self._leave(ticket)
+            raise
+
+    def _try_take(self, ticket: tuple, endpoints: List[Endpoint], tokens: int, enqueued: float) -> tuple:
+        """(endpoint, None) if the call may go now, else (None, seconds to wait); called with the condition held"""
+        now = time.monotonic()
+        # Strict priority order among the calls competing for the same endpoints
+        if not self._is_next(ticket, self._waiting[ticket]):
+            return None, 1.0
+        wait, endpoint = self._best_endpoint(endpoints, tokens, now)
+        if wait > 0:
+            return None, wait
+        del self._waiting[ticket]
+        endpoint.request_bucket.take(1, now)
+        endpoint.token_bucket.take(tokens, now)
+        endpoint.in_flight += 1
+        endpoint.requests += 1
+        waited = self._queue_wait.setdefault(ticket[0], [0, 0.0])
+        waited[0] += 1
+        waited[1] += now - enqueued
+        self._condition.notify_all()
+        return endpoint, None
+
+    def _leave(self, ticket: tuple):
+        # Called with the condition held, when a waiting call gives up
+        if self._waiting.pop(ticket, None) is not None:
+            self._condition.notify_all()
+
+    def _is_next(self, ticket: tuple, usable: FrozenSet[Endpoint]) -> bool:
+        # Called with the condition held
+        return not any(
+            other < ticket and not usable.isdisjoint(other_usable)
+            for other, other_usable in self._waiting.items()
+        )
+
+    @staticmethod
+    def _best_endpoint(endpoints: List[Endpoint], tokens: int, now: float) -> tuple:
+        """(seconds to wait, endpoint): the first available endpoint with the most headroom"""
+        wait, _, index = min(
+            (endpoint.wait_time(tokens, now), -endpoint.headroom(now), index)
+            for index, endpoint in enumerate(endpoints)
+        )
+        return wait, endpoints[index]
+
+    def release(self, endpoint: Endpoint, estimated_tokens: int, used_tokens: Optional[int] = None):
+        """Finish a call, correcting the token budget with the reported usage"""
+        with self._condition:
+            endpoint.in_flight -= 1
+            if used_tokens is not None:
+                endpoint.token_bucket.give_back(estimated_tokens - used_tokens)
+            self._condition.notify_all()
+
+    def rate_limited(self, endpoint: Endpoint, attempt: int, retry_after: Optional[float] = None) -> float:
+        """Put the endpoint into a cool-down after a 429, returns its length in seconds"""
+        delay = retry_after if retry_after is not None else self.backoff(attempt)
+        with self._condition:
+            endpoint.in_flight -= 1
+            endpoint.rate_limited += 1
+            endpoint.cooldown_until = max(endpoint.cooldown_until, time.monotonic() + delay)
+            self._retries += 1
+            self._condition.notify_all()
+        logger.warning(f"Endpoint {endpoint.name} rate limited, cooling down for {delay:.2f}s (attempt {attempt + 1})")
+        return delay
+
+    def backoff(self, attempt: int) -> float:
+        # Full jitter between half and all of the exponential delay
+        return min(self.max_backoff, self.base_backoff * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        with self._condition:
+            return {
+                "queued": len(self._waiting),
+                "retries": self._retries,
+                "queue_wait": {
+                    priority: {"calls": calls, "avg_seconds": round(total / calls, 4) if calls else 0.0}
+                    for priority, (calls, total) in sorted(self._queue_wait.items())
+                },
+                "endpoints": [endpoint.stats(now) for endpoint in self.endpoints],
+            }
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except ValueError:
+        pass
+    return None
+
+
+def _is_retryable(error: Exception) -> bool:
+    return getattr(error, "status_code", None) in RETRYABLE_STATUS_CODES
+
+
+def _used_tokens(usage: Optional[Dict[str, Any]]) -> Optional[int]:
+    if not usage:
+        return None
+    return usage.get("total_tokens") or usage.get("input_tokens", 0) + usage.get("output_tokens", 0)
+
+
+def _result_usage(result: ChatResult) -> Optional[Dict[str, Any]]:
+    return (result.llm_output or {}).get("token_usage") or getattr(result.generations[0].message, "usage_metadata", None)
+
+
+def _openai_tool_choice(tool_choice: Any, tools: List[Dict[str, Any]]) -> Any:
+    """tool_choice in the chat completions format, as ChatOpenAI.bind_tools maps it"""
+    names = [tool["function"]["name"] for tool in tools]
+    if tool_choice is True:
+        tool_choice = names[0]
+    if isinstance(tool_choice, str):
+        if tool_choice in names:
+            return {"type": "function", "function": {"name": tool_choice}}
+        if tool_choice == "any":
+            return "required"
+    return tool_choice
+
+
+class DispatchedChatModel(BaseChatModel):
+    """Chat model sending every call through an LLMDispatcher
+
+    `endpoints` are the dispatcher endpoints this model may use and `clients`
+    holds one provider client per endpoint, keyed by endpoint name; they
+    should not retry on their own (max_retries=0).
+    """
+
+    model_config = ConfigDict(arbitrary_types_allowed=True, protected_namespaces=())
+
+    dispatcher: LLMDispatcher
+    endpoints: List[Endpoint]
+    clients: Dict[str, BaseChatModel]
+    model_name: str
+    priority: int = PRIORITY_WORKER
+
+    @property
+    def _llm_type(self) -> str:
+        return "dispatched-chat-model"
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return {"model_name": self.model_name, "endpoints": list(self.clients)}
+
+    def with_priority(self, priority: int) -> "DispatchedChatModel":
+        """A copy sharing dispatcher and clients that queues with another priority"""
+        return self.model_copy(update={"priority": priority})
+
+    def bind_tools(self, tools, *, tool_choice: Any = None, **kwargs: Any):
+        """Bind tools in the chat completions format to this model, so tool calls are dispatched too"""
+        formatted = [convert_to_openai_tool(tool) for tool in tools]
+        if tool_choice is not None and tool_choice is not False:
+            kwargs["tool_choice"] = _openai_tool_choice(tool_choice, formatted)
+        return self.bind(tools=formatted, **kwargs)
+
+    def with_structured_output(self, schema, *, include_raw: bool = False, **kwargs: Any):
+        """Structured output by forced tool calling on this model, so router calls are dispatched too
+
+        Only the function calling method is supported: a provider client's own
+        json_schema or json_mode implementation would bypass the dispatcher.
+        """
+        method = kwargs.pop("method", "function_calling")
+        if method != "function_calling":
+            raise ValueError(f"DispatchedChatModel only supports structured output by function calling, got {method}")
+        return super().with_structured_output(schema, include_raw=include_raw, **kwargs)
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        estimated = estimate_request_tokens(messages)
+        ticket = self.dispatcher.ticket(self.priority)
+        for attempt in range(self.dispatcher.max_retries + 1):
+            endpoint = self.dispatcher.acquire(self.priority, estimated, self.endpoints, ticket)
+            try:
+                result = self.clients[endpoint.name]._generate(messages, stop=stop, run_manager=run_manager, **kwargs)
+            except Exception as e:
+                if not _is_retryable(e) or attempt == self.dispatcher.max_retries:
+                    self.dispatcher.release(endpoint, estimated)
+                    raise
+                self.dispatcher.rate_limited(endpoint, attempt, _retry_after(e))
+                continue
+            self.dispatcher.release(endpoint, estimated, _used_tokens(_result_usage(result)))
+            return result
+        raise RuntimeError("unreachable")
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        estimated = estimate_request_tokens(messages)
+        ticket = self.dispatcher.ticket(self.priority)
+        for attempt in range(self.dispatcher.max_retries + 1):
+            endpoint = await self.dispatcher.acquire_async(self.priority, estimated, self.endpoints, ticket)
+            try:
+                result = await self.clients[endpoint.name]._agenerate(
+                    messages, stop=stop, run_manager=run_manager, **kwargs
+                )
+            except asyncio.CancelledError:
+                self.dispatcher.release(endpoint, estimated)
+                raise
+            except Exception as e:
+                if not _is_retryable(e) or attempt == self.dispatcher.max_retries:
+                    self.dispatcher.release(endpoint, estimated)
+                    raise
+                self.dispatcher.rate_limited(endpoint, attempt, _retry_after(e))
+                continue
+            self.dispatcher.release(endpoint, estimated, _used_tokens(_result_usage(result)))
+            return result
+        raise RuntimeError("unreachable")
+
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        estimated = estimate_request_tokens(messages)
+        ticket = self.dispatcher.ticket(self.priority)
+        for attempt in range(self.dispatcher.max_retries + 1):
+            endpoint = self.dispatcher.acquire(self.priority, estimated, self.endpoints, ticket)
+            started = False
+            usage = None
+            try:
+                for chunk in self.clients[endpoint.name]._stream(messages, stop=stop, run_manager=run_manager, **kwargs):
+                    started = True
+                    usage = getattr(chunk.message, "usage_metadata", None) or usage
+                    yield chunk
+            except GeneratorExit:
+                # The consumer stopped reading, e.g. the run was cancelled
+                self.dispatcher.release(endpoint, estimated)
+                raise
+            except Exception as e:
+                # Once chunks were handed out the call cannot be repeated transparently
+                if started or not _is_retryable(e) or attempt == self.dispatcher.max_retries:
+                    self.dispatcher.release(endpoint, estimated)
+                    raise
+                self.dispatcher.rate_limited(endpoint, attempt, _retry_after(e))
+                continue
+            self.dispatcher.release(endpoint, estimated, _used_tokens(usage))
+            return
+
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        estimated = estimate_request_tokens(messages)
+        ticket = self.dispatcher.ticket(self.priority)
+        for attempt in range(self.dispatcher.max_retries + 1):
+            endpoint = await self.dispatcher.acquire_async(self.priority, estimated, self.endpoints, ticket)
+            started = False
+            usage = None
+            try:
+                async for chunk in self.clients[endpoint.name]._astream(
+                    messages, stop=stop, run_manager=run_manager, **kwargs
+                ):
+                    started = True
+                    usage = getattr(chunk.message, "usage_metadata", None) or usage
+                    yield chunk
+            except (GeneratorExit, asyncio.CancelledError):
+                self.dispatcher.release(endpoint, estimated)
+                raise
+            except Exception as e:
+                if started or not _is_retryable(e) or attempt == self.dispatcher.max_retries:
+                    self.dispatcher.release(endpoint, estimated)
+                    raise
+                self.dispatcher.rate_limited(endpoint, attempt, _retry_after(e))
+                continue
+            self.dispatcher.release(endpoint, estimated, _used_tokens(usage))
+            return
@@ -9,16 +9,38 @@ from node import State
 from node import make_supervisor_node
 from node import create_search_node, create_web_scraper_node
 from node import create_doc_writing_node, create_note_taking_node, create_chart_generating_node
-from node import create_research_team_invoke_node, create_writing_team_invoke_node
+from node import create_research_team_invoke_node, create_writing_team_invoke_node, create_outline_drafter
 from tools.writing_tools import WritingTools
+from tools.output_budget import ToolOutputBudget
+from routing import build_research_team_policy, build_research_team_predictors, build_writing_team_policy
+from routing import build_super_team_policy, route_fresh_query_to
+from speculation import Speculator
+from pipeline import FindingsBoard, ResearchPipeline, HANDOFF_MARKER
+from models import ModelPool, resolve_llm
 
 logger = logging.getLogger(__name__)
 
-def build_research_team_graph(llm: BaseChatModel, search_tool: BaseTool):
+def build_research_team_graph(llm: BaseChatModel, search_tool: BaseTool, fast_routing: bool = True,
+                              output_budget: ToolOutputBudget = None, scrape_tool: BaseTool = None,
+                              model_pool: ModelPool = None, findings_board: FindingsBoard = None,
+                              speculative: bool = False):
     logger.info("Starting to build research_team_graph")
-    research_supervisor_node = make_supervisor_node(llm, ["search", "web_scraper"])
-    search_node = create_search_node(llm, search_tool, goto='supervisor')
-    web_scraper_node = create_web_scraper_node(llm, goto='supervisor')
+    # Both workers only read, so either can be started while the LLM router decides
+    speculator = Speculator(build_research_team_predictors()) if speculative else None
+    research_supervisor_node = make_supervisor_node(
+        resolve_llm(llm, model_pool, "research_team.supervisor"), ["search", "web_scraper"],
+        routing_policy=build_research_team_policy() if fast_routing else None,
+        speculator=speculator,
+    )
+    search_node = create_search_node(
+        resolve_llm(llm, model_pool, "research_team.search"), search_tool, goto='supervisor',
+        findings_board=findings_board, speculator=speculator,
+    )
+    web_scraper_node = create_web_scraper_node(
+        resolve_llm(llm, model_pool, "research_team.web_scraper"), goto='supervisor',
+        output_budget=output_budget, scrape_tool=scrape_tool, findings_board=findings_board,
+        speculator=speculator,
+    )
     research_builder = StateGraph(State)
     research_builder.add_node("supervisor", research_supervisor_node)
     research_builder.add_node("search", search_node)
@@ -30,17 +52,22 @@ def build_research_team_graph(llm: BaseChatModel, search_tool: BaseTool):
     logger.info("research_team_graph build completed")
     return compiled_graph
 
-def build_writing_team_graph(llm: BaseChatModel, working_dir: Path):
+def build_writing_team_graph(llm: BaseChatModel, working_dir: Path, fast_routing: bool = True,
+                             output_budget: ToolOutputBudget = None, model_pool: ModelPool = None,
+                             pipelined: bool = False):
     logger.info(f"Starting to build writing_team_graph, working_dir: {working_dir}")
     doc_writing_supervisor_node = make_supervisor_node(
-        llm, ["doc_writer", "note_taker", "chart_generator"]
+        resolve_llm(llm, model_pool, "writing_team.supervisor"), ["doc_writer", "note_taker", "chart_generator"],
+        routing_policy=build_writing_team_policy(HANDOFF_MARKER if pipelined else None) if fast_routing else None,
     )
     
     # Create WritingTools instance, using the working directory passed in from outside
-    writing_tools = WritingTools(working_dir)
-    doc_writing_node = create_doc_writing_node(llm, writing_tools)
-    note_taking_node = create_note_taking_node(llm, writing_tools)
-    chart_generating_node = create_chart_generating_node(llm, writing_tools)
+    writing_tools = WritingTools(working_dir, output_budget=output_budget)
+    doc_writing_node = create_doc_writing_node(resolve_llm(llm, model_pool, "writing_team.doc_writer"), writing_tools)
+    note_taking_node = create_note_taking_node(resolve_llm(llm, model_pool, "writing_team.note_taker"), writing_tools)
+    chart_generating_node = create_chart_generating_node(
+        resolve_llm(llm, model_pool, "writing_team.chart_generator"), writing_tools
+    )
 
     # Create the graph here
     paper_writing_builder = StateGraph(State)
@@ -55,7 +82,16 @@ def build_writing_team_graph(llm: BaseChatModel, working_dir: Path):
     logger.info("writing_team_graph build completed")
     return compiled_graph
 
-def build_super_team_graph(llm: BaseChatModel, research_graph, writing_graph):
+def build_research_writing_pipeline(llm: BaseChatModel, working_dir: Path, findings_board: FindingsBoard,
+                                    output_budget: ToolOutputBudget = None, model_pool: ModelPool = None):
+    """Outline drafting from partial research, for build_super_team_graph(pipeline=...)"""
+    writing_tools = WritingTools(working_dir, output_budget=output_budget)
+    drafter = create_outline_drafter(resolve_llm(llm, model_pool, "writing_team.note_taker"), writing_tools)
+    return ResearchPipeline(findings_board, drafter, working_dir)
+
+def build_super_team_graph(llm: BaseChatModel, research_graph, writing_graph, fast_routing: bool = True,
+                           model_pool: ModelPool = None, speculative: bool = False,
+                           pipeline: ResearchPipeline = None):
     logger.info("Starting to build super_team_graph")
     logger.info(f"Input parameters - llm: {llm}, research_graph: {research_graph}, writing_graph: {writing_graph}")
     
@@ -67,8 +103,17 @@ def build_super_team_graph(llm: BaseChatModel, research_graph, writing_graph):
         logger.error("writing_graph is None, cannot build super_team")
         return None
     
-    teams_supervisor_node = make_supervisor_node(llm, ["research_team", "writing_team"])
-    call_research_team = create_research_team_invoke_node(research_graph)
+    # Research is the only speculation target, writing has side effects on the working directory.
+    # With fast routing a rule already sends fresh queries to research, so this only fires without it.
+    speculator = Speculator(
+        [route_fresh_query_to("research_team")], {"research_team": research_graph}
+    ) if speculative else None
+    teams_supervisor_node = make_supervisor_node(
+        resolve_llm(llm, model_pool, "super_team.supervisor"), ["research_team", "writing_team"],
+        routing_policy=build_super_team_policy(HANDOFF_MARKER if pipeline else None) if fast_routing else None,
+        speculator=speculator,
+    )
+    call_research_team = create_research_team_invoke_node(research_graph, speculator=speculator, pipeline=pipeline)
     call_writing_team = create_writing_team_invoke_node(writing_graph)
 
     super_builder = StateGraph(State)
@@ -3,52 +3,114 @@
 import argparse
 import tempfile
 import shutil
+import time
 from pathlib import Path
 
-from langchain_openai import ChatOpenAI
-from langchain_community.tools.tavily_search import TavilySearchResults
+# LangChain, LangGraph and the tools are imported inside the run modes so that
+# `--help` and argument errors return without paying for those imports
 
-from config import setup_environment
-from graph import build_research_team_graph, build_writing_team_graph
-from graph import build_super_team_graph
 
+DEFAULT_QUERY = "Research AI agents and write a brief report about them."
 
-def run_cli_mode():
-    """Run command line interactive mode (for testing)"""
-    setup_environment()
 
-    llm = ChatOpenAI(model='gpt-4o')
-    # llm = ChatOpenAI(
-    #     model="openai/gpt-4o-2024-11-20",
-    #     temperature=0,
-    #     api_key=os.environ["OPENROUTER_API_KEY"],
-    #     base_url="https://openrouter.ai/api/v1",
-    # )
+def run_cli_mode(query=DEFAULT_QUERY, record=None, replay=None, replay_speed="zero", speculative=False,
+                 pipelined=False):
+    """Run command line interactive mode (for testing)
+
+    `record` captures LLM and tool interactions to a cassette file, `replay` answers
+    them from one instead of calling the providers, see cassette.py.
+    """
+    from graph import build_research_team_graph, build_writing_team_graph
+    from graph import build_super_team_graph, build_research_writing_pipeline
+    from pipeline import FindingsBoard
+    from tools import ArtifactStore, ToolOutputBudget
+
+    callbacks = []
+    model_pool = None
+    if replay:
+        from cassette import Cassette, ReplayChatModel, ReplayTool
+        from tools import FakeSearchBackend, scrape_webpages
 
-    tavily_tool = TavilySearchResults(max_results=5)
+        cassette = Cassette.load(Path(replay))
+        llm = ReplayChatModel(cassette=cassette, speed=replay_speed)
+        tavily_tool = ReplayTool.from_tool(FakeSearchBackend(), cassette, replay_speed)
+        scrape_tool = ReplayTool.from_tool(scrape_webpages, cassette, replay_speed)
+    else:
+        model_pool, tavily_tool = _create_model_pool_and_search_tool()
+        llm = model_pool.default_llm
+        scrape_tool = None
+        if record:
+            from cassette import Cassette, CassetteRecorder
+
+            cassette = Cassette(Path(record))
+            callbacks.append(CassetteRecorder(cassette))
 
     # Create temporary directory as working directory
     temp_dir = Path(tempfile.mkdtemp(prefix="agent_cli_"))
     try:
-        research_team = build_research_team_graph(llm, tavily_tool)
-        writing_team = build_writing_team_graph(llm, temp_dir)
-        super_team = build_super_team_graph(llm, research_team, writing_team)
+        artifact_store = ArtifactStore(temp_dir / ".artifacts")
+        paging_tool = None
+        if replay:
+            paging_tool = ReplayTool.from_tool(ToolOutputBudget(artifact_store).get_paging_tool(), cassette, replay_speed)
+        output_budget = ToolOutputBudget(artifact_store, paging_tool=paging_tool)
+        findings_board = FindingsBoard() if pipelined else None
+        research_team = build_research_team_graph(
+            llm, tavily_tool, output_budget=output_budget, scrape_tool=scrape_tool, model_pool=model_pool,
+            findings_board=findings_board, speculative=speculative,
+        )
+        writing_team = build_writing_team_graph(
+            llm, temp_dir, output_budget=output_budget, model_pool=model_pool, pipelined=pipelined
+        )
+        pipeline = None
+        if pipelined:
+            pipeline = build_research_writing_pipeline(
+                llm, temp_dir, findings_board, output_budget=output_budget, model_pool=model_pool
+            )
+        super_team = build_super_team_graph(
+            llm, research_team, writing_team, model_pool=model_pool, speculative=speculative, pipeline=pipeline
+        )
 
+        started = time.perf_counter()
         for s in super_team.stream(
             {
                 "messages": [
-                    ("user", "Research AI agents and write a brief report about them.")
+                    ("user", query)
                 ],
             },
-            {"recursion_limit": 150},
+            {"recursion_limit": 150, "callbacks": callbacks},
         ):
             print(s)
             print("---")
+        print(f"Run completed in {time.perf_counter() - started:.3f}s")
     finally:
+        if record and not replay:
+            cassette.save()
         # Clean up temporary directory
         shutil.rmtree(temp_dir, ignore_errors=True)
 
 
+def _create_model_pool_and_search_tool():
+    from langchain_community.tools.tavily_search import TavilySearchResults
+
+    from config import setup_environment
+    from models import ModelPool
+    from tools import SearchCache, CachedSearchTool
+
+    setup_environment()
+
+    # Models per node from AGENT_MODELS_CONFIG, gpt-4o everywhere by default
+    model_pool = ModelPool.from_env()
+    # llm = ChatOpenAI(
+    #     model="openai/gpt-4o-2024-11-20",
+    #     temperature=0,
+    #     api_key=os.environ["OPENROUTER_API_KEY"],
+    #     base_url="https://openrouter.ai/api/v1",
+    # )
+
+    tavily_tool = CachedSearchTool(TavilySearchResults(max_results=5), SearchCache.from_env())
+    return model_pool, tavily_tool
+
+
 def run_api_mode(host="0.0.0.0", port=8000):
     """Start API server"""
     import uvicorn
@@ -60,9 +122,19 @@ if __name__ == '__main__':
     parser.add_argument('--api', action='store_true', help='Run in API server mode')
     parser.add_argument('--host', type=str, default="0.0.0.0", help='API server listening address')
     parser.add_argument('--port', type=int, default=8000, help='API server listening port')
+    parser.add_argument('--query', type=str, default=DEFAULT_QUERY, help='Query for command line mode')
+    parser.add_argument('--record', type=str, help='Record LLM and tool interactions to this cassette file')
+    parser.add_argument('--replay', type=str, help='Replay LLM and tool interactions from this cassette file')
+    parser.add_argument('--replay-speed', choices=['recorded', 'zero'], default='zero',
+                        help='Replay at the recorded latency or with zero latency')
+    parser.add_argument('--speculative', action='store_true',
+                        help='Start the likely next research step while a supervisor asks its LLM router')
+    parser.add_argument('--pipelined', action='store_true',
+                        help='Draft the outline from partial research while research continues')
     args = parser.parse_args()
 
     if args.api:
         run_api_mode(host=args.host, port=args.port)
     else:
-        run_cli_mode()
+        run_cli_mode(query=args.query, record=args.record, replay=args.replay, replay_speed=args.replay_speed,
+                     speculative=args.speculative, pipelined=args.pipelined)
@@ -0,0 +1,196 @@
+# coding: utf-8
+"""Per-node model configuration and pooled LLM clients
+
+A JSON config (AGENT_MODELS_CONFIG, see models.example.json) names model
+specs and maps graph nodes to them:
+
+    {
+      "models": {"router": {"model": "gpt-4o-mini", "temperature": 0}, ...},
+      "nodes": {"supervisor": "router", "writing_team.doc_writer": "flagship"},
+      "default": "flagship",
+      "http": {"max_connections": 50, "max_keepalive_connections": 20, "keepalive_expiry": 60},
+      "dispatcher": {"max_retries": 6, "base_backoff": 0.5, "max_backoff": 30}
+    }
+
+Node names are "<team>.<node>" with team one of super_team, research_team and
+writing_team; a bare node name applies to that node in every team. Nodes
+without an entry use the default model. Each distinct spec gets one chat model
+instance, and all instances talking to the same base URL share one pair of
+keep-alive HTTP clients.
+
+Every model is a `DispatchedChatModel` (see dispatcher.py) and all of them
+share the pool's dispatcher, so router calls are queued ahead of writer calls
+even when the two use different model specs. A spec may list several
+"endpoints", each with optional "base_url", "api_key_env", "rpm" and "tpm", to
+spread its calls over several API keys or providers; without them the model
+has one endpoint with the spec's own base URL and key and no rate budgets, so
+only 429 retries and priorities apply. Endpoints are identified by base URL
+and key: specs using the same pair share one endpoint and its rate budgets,
+limited by the smallest rpm/tpm any of them declares.
+"""
+
+import os
+import json
+import hashlib
+import logging
+import threading
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+from langchain_core.language_models.chat_models import BaseChatModel
+
+from dispatcher import DispatchedChatModel, Endpoint, LLMDispatcher, priority_for_node
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL_SPEC = {"model": "gpt-4o"}
+DEFAULT_HTTP_SETTINGS = {"max_connections": 50, "max_keepalive_connections": 20, "keepalive_expiry": 60.0}
+
+
+class ModelPool:
+    """Resolves graph nodes to shared, pooled chat model clients"""
+
+    def __init__(self, config: Optional[Dict[str, Any]] = None):
+        config = config or {}
+        self.models: Dict[str, Dict[str, Any]] = dict(config.get("models", {}))
+        self.models.setdefault("default", dict(DEFAULT_MODEL_SPEC))
+        self.nodes: Dict[str, str] = dict(config.get("nodes", {}))
+        self.default = config.get("default", "default")
+        self.http_settings = dict(DEFAULT_HTTP_SETTINGS, **config.get("http", {}))
+        self.dispatcher_settings = dict(config.get("dispatcher", {}))
+        for node, name in list(self.nodes.items()) + [("default", self.default)]:
+            if name not in self.models:
+                raise ValueError(f"Node {node} refers to unknown model {name}")
+        self.dispatcher = LLMDispatcher(**self.dispatcher_settings)
+        self._endpoints: Dict[Tuple[str, str], Endpoint] = {}
+        self._clients: Dict[str, DispatchedChatModel] = {}
+        self._http_clients: Dict[Optional[str], tuple] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_file(cls, path: Path) -> "ModelPool":
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    @classmethod
+    def from_env(cls) -> "ModelPool":
+        """Load AGENT_MODELS_CONFIG, or use the default model for every node"""
+        path = os.environ.get("AGENT_MODELS_CONFIG")
+        if not path:
+            return cls()
+        logger.info(f"Loading model configuration from {path}")
+        return cls.from_file(Path(path))
+
+    def model_name_for(self, node: str) -> str:
+        """Name of the model spec used by a "<team>.<node>" node"""
+        bare = node.rsplit(".", 1)[-1]
+        return self.nodes.get(node) or self.nodes.get(bare) or self.default
+
+    def for_node(self, node: str) -> BaseChatModel:
+        """The node's model, queued with the node's dispatch priority (routers first)"""
+        return self.get(self.model_name_for(node)).with_priority(priority_for_node(node))
+
+    @property
+    def default_llm(self) -> BaseChatModel:
+        return self.get(self.default)
+
+    def get(self, name: str) -> DispatchedChatModel:
+        with self._lock:
+            if name not in self._clients:
+                self._clients[name] = self._create(name, dict(self.models[name]))
+            return self._clients[name]
+
+    def _create(self, name: str, spec: Dict[str, Any]) -> DispatchedChatModel:
+        endpoint_specs = spec.pop("endpoints", None) or [{}]
+        endpoints, clients = [], {}
+        for endpoint_spec in endpoint_specs:
+            endpoint_spec = dict(endpoint_spec)
+            endpoint = self._endpoint_for(
+                dict(spec, **endpoint_spec),
+                endpoint_spec.pop("name", None),
+                endpoint_spec.pop("rpm", None),
+                endpoint_spec.pop("tpm", None),
+            )
+            if endpoint.name in clients:
+                continue
+            endpoints.append(endpoint)
+            clients[endpoint.name] = self._create_client(dict(spec, **endpoint_spec))
+        return DispatchedChatModel(
+            dispatcher=self.dispatcher,
+            endpoints=endpoints,
+            clients=clients,
+            model_name=spec["model"],
+        )
+
+    def _endpoint_for(self, spec: Dict[str, Any], name: Optional[str], rpm: Optional[float],
+                      tpm: Optional[float]) -> Endpoint:
+        """The shared endpoint of a base URL and API key, created on first use; called with the pool lock held"""
+        key = spec.get("api_key_env") or "OPENAI_API_KEY"
+        if spec.get("api_key") and not spec.get("api_key_env"):
+            # Identify literal keys without keeping them around in stats or logs
+            key = "key-" + hashlib.sha256(str(spec["api_key"]).encode("utf-8")).hexdigest()[:12]
+        identity = (spec.get("base_url") or "", key)
+        endpoint = self._endpoints.get(identity)
+        if endpoint is None:
+            endpoint = Endpoint(name or f"{identity[0] or 'default'}|{key}", rpm=rpm, tpm=tpm)
+            self._endpoints[identity] = endpoint
+            self.dispatcher.add_endpoint(endpoint)
+        else:
+            endpoint.tighten(rpm=rpm, tpm=tpm)
+        return endpoint
+
+    def _create_client(self, spec: Dict[str, Any]) -> BaseChatModel:
+        from langchain_openai import ChatOpenAI
+
+        api_key_env = spec.pop("api_key_env", None)
+        if api_key_env:
+            spec["api_key"] = os.environ.get(api_key_env)
+            if not spec["api_key"]:
+                raise ValueError(
+                    f"Model {spec.get('model')} ({spec.get('base_url') or 'default endpoint'}) reads its API key "
+                    f"from {api_key_env}, which is not set"
+                )
+        http_client, http_async_client = self._http_clients_for(spec.get("base_url"))
+        # stream_usage reports token usage while streaming, which run budgets rely on
+        spec.setdefault("stream_usage", True)
+        # Retries go through the dispatcher, which can move them to another endpoint
+        spec.setdefault("max_retries", 0)
+        logger.info(f"Creating chat model client: {spec.get('model')} ({spec.get('base_url') or 'default endpoint'})")
+        return ChatOpenAI(http_client=http_client, http_async_client=http_async_client, **spec)
+
+    def _http_clients_for(self, base_url: Optional[str]) -> tuple:
+        # Called with the pool lock held
+        if base_url not in self._http_clients:
+            import httpx
+
+            settings = self.http_settings
+            limits = httpx.Limits(
+                max_connections=settings["max_connections"],
+                max_keepalive_connections=settings["max_keepalive_connections"],
+                keepalive_expiry=settings["keepalive_expiry"],
+            )
+            self._http_clients[base_url] = (httpx.Client(limits=limits), httpx.AsyncClient(limits=limits))
+        return self._http_clients[base_url]
+
+    def stats(self) -> Dict[str, Any]:
+        """Dispatcher queue and endpoint statistics, with the endpoints of the models created so far"""
+        with self._lock:
+            clients = dict(self._clients)
+        return dict(
+            self.dispatcher.stats(),
+            models={name: [endpoint.name for endpoint in client.endpoints] for name, client in clients.items()},
+        )
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "default": self.default,
+            "nodes": dict(self.nodes),
+            "models": {name: spec.get("model") for name, spec in self.models.items()},
+        }
+
+
+def resolve_llm(llm: BaseChatModel, model_pool: Optional[ModelPool], node: str) -> BaseChatModel:
+    """The model configured for `node`, or `llm` when no pool is used (e.g. when replaying)"""
+    if model_pool is None:
+        return llm
+    return model_pool.for_node(node)
@@ -4,15 +4,20 @@ from typing import Literal
 from typing_extensions import TypedDict
 import logging
 from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.runnables import RunnableConfig
 
 from langgraph.graph import MessagesState, END
 from langgraph.types import Command
-from langchain_core.messages import HumanMessage
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
 
 from langgraph.prebuilt import create_react_agent
-from langchain_community.tools.tavily_search import TavilySearchResults
+from langchain_core.tools import BaseTool
 
-from tools import scrape_webpages, WritingTools
+from tools import scrape_webpages, WritingTools, ToolOutputBudget
+from routing import RoutingPolicy, SAVED_DOCUMENTS_KEY
+from speculation import Speculation, Speculator
+from pipeline import FindingsBoard, ResearchPipeline, DRAFTS_DIR_NAME, findings_scope
+from budget import BudgetExhausted, get_budget_tracker
 
 # 获取日志记录器
 logger = logging.getLogger(__name__)
@@ -21,7 +26,62 @@ class State(MessagesState):
     next: str
 
 
-def make_supervisor_node(llm: BaseChatModel, members: list[str]) -> str:
+def _worker_input(state: State) -> dict:
+    # What a worker node passes to its agent, for speculative runs of the agent
+    return {"messages": state["messages"]}
+
+
+def _team_input(state: State) -> dict:
+    # What a team invoke node passes to its team's graph, the supervisor's last message
+    return {"messages": [state["messages"][-1]]}
+
+
+def _invoke_worker(agent, state: State, speculation: Speculation = None) -> list:
+    """Run a worker's agent loop or a team's graph, or take its committed speculative run, and return its messages
+
+    When the run budget runs out mid-loop, the budget tracker raises at the next
+    LLM or tool call. The messages gathered so far are then returned with a
+    closing note, so the supervisor still receives the partial result.
+    """
+    messages = list(state["messages"])
+    try:
+        if speculation is not None:
+            logger.info(f"Using the result of the speculative {speculation.member} run")
+            messages = speculation.result()["messages"]
+        else:
+            for values in agent.stream(state, stream_mode="values"):
+                messages = values["messages"]
+    except BudgetExhausted as e:
+        if speculation is not None and speculation.last_state is not None:
+            messages = speculation.last_state["messages"]
+        logger.info(f"Worker stopped early: {str(e)}")
+        new_messages = messages[len(state["messages"]):]
+        partial = next((m.content for m in reversed(new_messages) if isinstance(m.content, str) and m.content), "")
+        messages = messages + [AIMessage(content=f"{partial}\n\n[Stopped early: {str(e)}]".strip())]
+    return messages
+
+
+# Tools whose successful calls leave a document in the working directory
+DOCUMENT_TOOLS = ("write_document", "edit_document")
+
+
+def _saved_documents(messages: list) -> list[str]:
+    """File names saved by successful document tool calls among an agent's messages"""
+    calls = {call["id"]: call for message in messages for call in getattr(message, "tool_calls", None) or []}
+    saved = []
+    for message in messages:
+        if getattr(message, "type", None) != "tool" or message.name not in DOCUMENT_TOOLS:
+            continue
+        if getattr(message, "status", "success") == "error" or str(message.content).startswith("Error"):
+            continue
+        file_name = calls.get(message.tool_call_id, {}).get("args", {}).get("file_name")
+        if file_name and not file_name.startswith(DRAFTS_DIR_NAME) and file_name not in saved:
+            saved.append(file_name)
+    return saved
+
+
+def make_supervisor_node(llm: BaseChatModel, members: list[str], routing_policy: RoutingPolicy = None,
+                         speculator: Speculator = None) -> str:
     options = ["FINISH"] + members
     system_prompt = (
         "You are a supervisor tasked with managing a conversation between the"
@@ -30,21 +90,60 @@ def make_supervisor_node(llm: BaseChatModel, members: list[str]) -> str:
         " task and respond with their results and status. When finished,"
         " respond with FINISH."
     )
+    wrap_up_prompt = (
+        "The budget for this run is almost used up. Only route to a worker if its"
+        " result is essential for a useful answer, otherwise respond with FINISH."
+    )
 
     class Router(TypedDict):
         """Worker to route to next. If no workers needed, route to FINISH."""
 
         next: Literal[*options] # type: ignore
 
-    def supervisor_node(state: State) -> Command[Literal[*members, "__end__"]]: # type: ignore
-        """An LLM-based router."""
+    # Built once per graph. System prompt and router schema stay a byte-identical prefix for
+    # provider prompt caching, so per-call notes such as wrap-up are appended after the history.
+    router_llm = llm.with_structured_output(Router)
+    system_message = SystemMessage(content=system_prompt)
+    wrap_up_message = SystemMessage(content=wrap_up_prompt)
+
+    def supervisor_node(state: State, config: RunnableConfig) -> Command[Literal[*members, "__end__"]]: # type: ignore
+        """An LLM-based router, behind an optional rule-based fast path."""
         logger.info(f"supervisor_node called, state: {state}")
-        messages = [
-            {"role": "system", "content": system_prompt},
-        ] + state["messages"]
+        budget_tracker = get_budget_tracker(config)
+        if budget_tracker is not None and budget_tracker.check():
+            # Stop handing out work and return what has been gathered so far
+            logger.info(f"Run budget exhausted ({budget_tracker.exhausted_reason}), finishing")
+            return Command(goto=END, update={"next": END})
+
+        if routing_policy is not None:
+            goto = routing_policy.decide(state, members)
+            if goto is not None:
+                if goto == "FINISH":
+                    goto = END
+                logger.info(f"Routing decision result (fast path): {goto}")
+                return Command(goto=goto, update={"next": goto})
+            routing_policy.record_llm()
+
+        messages = [system_message] + state["messages"]
+        if budget_tracker is not None and budget_tracker.should_wrap_up():
+            messages.append(wrap_up_message)
+        # Start the likely next team while the router decides
+        speculation = speculator.start(state, members, config) if speculator is not None else None
         logger.info(f"Calling LLM for routing decision, messages length: {len(messages)}")
-        response = llm.with_structured_output(Router).invoke(messages)
+        try:
+            response = router_llm.invoke(messages)
+        except BudgetExhausted as e:
+            if speculation is not None:
+                speculator.resolve(speculation, None)
+            logger.info(f"{str(e)}, finishing")
+            return Command(goto=END, update={"next": END})
+        except BaseException:
+            if speculation is not None:
+                speculator.resolve(speculation, None)
+            raise
         goto = response["next"]
+        if speculation is not None:
+            speculator.resolve(speculation, goto)
         if goto == "FINISH":
             goto = END
         logger.info(f"Routing decision result: {goto}")
@@ -52,16 +151,22 @@ def make_supervisor_node(llm: BaseChatModel, members: list[str]) -> str:
 
     return supervisor_node
 
-def create_search_node(llm: BaseChatModel, tavily_tool:TavilySearchResults, goto: str = 'supervisor') -> callable:
+def create_search_node(llm: BaseChatModel, tavily_tool: BaseTool, goto: str = 'supervisor',
+                       findings_board: FindingsBoard = None, speculator: Speculator = None) -> callable:
     search_agent = create_react_agent(llm, tools=[tavily_tool])
+    if speculator is not None:
+        speculator.add_target("search", search_agent, _worker_input)
 
-    def search_node(state: State) -> Command[Literal["supervisor"]]:
+    def search_node(state: State, config: RunnableConfig) -> Command[Literal["supervisor"]]:
         logger.info(f"search_node called, state: {state}")
-        result = search_agent.invoke(state)
+        speculation = speculator.take(state, "search", config) if speculator is not None else None
+        messages = _invoke_worker(search_agent, state, speculation)
+        if findings_board is not None:
+            findings_board.publish(findings_scope(config), "search", messages[-1].content)
         return Command(
             update={
                 "messages": [
-                    HumanMessage(content=result["messages"][-1].content, name="search")
+                    HumanMessage(content=messages[-1].content, name="search")
                 ]
             },
             # We want our workers to ALWAYS "report back" to the supervisor when done
@@ -70,16 +175,28 @@ def create_search_node(llm: BaseChatModel, tavily_tool:TavilySearchResults, goto
 
     return search_node
 
-def create_web_scraper_node(llm: BaseChatModel, goto: str = "supervisor") -> callable:
-    web_scraper_agent = create_react_agent(llm, tools=[scrape_webpages])
+def create_web_scraper_node(llm: BaseChatModel, goto: str = "supervisor", output_budget: ToolOutputBudget = None,
+                            scrape_tool: BaseTool = None, findings_board: FindingsBoard = None,
+                            speculator: Speculator = None) -> callable:
+    scrape_tool = scrape_tool or scrape_webpages
+    if output_budget is not None:
+        tools = [output_budget.wrap(scrape_tool), output_budget.get_paging_tool()]
+    else:
+        tools = [scrape_tool]
+    web_scraper_agent = create_react_agent(llm, tools=tools)
+    if speculator is not None:
+        speculator.add_target("web_scraper", web_scraper_agent, _worker_input)
 
-    def web_scraper_node(state: State) -> Command[Literal["supervisor"]]:
+    def web_scraper_node(state: State, config: RunnableConfig) -> Command[Literal["supervisor"]]:
         logger.info(f"web_scraper_node called, state: {state}")
-        result = web_scraper_agent.invoke(state)
+        speculation = speculator.take(state, "web_scraper", config) if speculator is not None else None
+        messages = _invoke_worker(web_scraper_agent, state, speculation)
+        if findings_board is not None:
+            findings_board.publish(findings_scope(config), "web_scraper", messages[-1].content)
         return Command(
             update={
                 "messages": [
-                    HumanMessage(content=result["messages"][-1].content, name="web_scraper")
+                    HumanMessage(content=messages[-1].content, name="web_scraper")
                 ]
             },
             # We want our workers to ALWAYS "report back" to the supervisor when done
@@ -100,11 +217,14 @@ def create_doc_writing_node(llm: BaseChatModel, writing_tools: WritingTools, got
 
     def doc_writing_node(state: State) -> Command[Literal["supervisor"]]:
         logger.info(f"doc_writing_node called, state: {state}")
-        result = doc_writer_agent.invoke(state)
+        messages = _invoke_worker(doc_writer_agent, state)
         return Command(
             update={
                 "messages": [
-                    HumanMessage(content=result["messages"][-1].content, name="doc_writer")
+                    HumanMessage(
+                        content=messages[-1].content, name="doc_writer",
+                        additional_kwargs={SAVED_DOCUMENTS_KEY: _saved_documents(messages)},
+                    )
                 ]
             },
             # We want our workers to ALWAYS "report back" to the supervisor when done
@@ -125,11 +245,11 @@ def create_note_taking_node(llm: BaseChatModel, writing_tools: WritingTools, got
 
     def note_taking_node(state: State) -> Command[Literal["supervisor"]]:
         logger.info(f"note_taking_node called, state: {state}")
-        result = note_taking_agent.invoke(state)
+        messages = _invoke_worker(note_taking_agent, state)
         return Command(
             update={
                 "messages": [
-                    HumanMessage(content=result["messages"][-1].content, name="note_taker")
+                    HumanMessage(content=messages[-1].content, name="note_taker")
                 ]
             },
             # We want our workers to ALWAYS "report back" to the supervisor when done
@@ -145,12 +265,12 @@ def create_chart_generating_node(llm: BaseChatModel, writing_tools: WritingTools
 
     def chart_generating_node(state: State) -> Command[Literal["supervisor"]]:
         logger.info(f"chart_generating_node called, state: {state}")
-        result = chart_generating_agent.invoke(state)
+        messages = _invoke_worker(chart_generating_agent, state)
         return Command(
             update={
                 "messages": [
                     HumanMessage(
-                        content=result["messages"][-1].content, name="chart_generator"
+                        content=messages[-1].content, name="chart_generator"
                     )
                 ]
             },
@@ -160,8 +280,33 @@ def create_chart_generating_node(llm: BaseChatModel, writing_tools: WritingTools
 
     return chart_generating_node
 
-def create_research_team_invoke_node(research_graph):
-    def call_research_team(state: State) -> Command[Literal["supervisor"]]:
+def create_outline_drafter(llm: BaseChatModel, writing_tools: WritingTools) -> callable:
+    """Note-taking agent drafting an outline from partial research, used by ResearchPipeline"""
+    drafting_agent = create_react_agent(
+        llm,
+        tools=writing_tools.get_tools(["outline"]),
+        prompt=(
+            "You draft preliminary report outlines from partial research findings while research is still "
+            "running. Don't ask follow-up questions."
+        ),
+    )
+
+    def draft_outline(query: str, findings: str, draft_path: str, config: RunnableConfig = None):
+        logger.info("draft_outline called")
+        drafting_agent.invoke({
+            "messages": [
+                HumanMessage(content=(
+                    f"Request: {query}\n\nPartial research findings so far:\n{findings}\n\n"
+                    f"Draft an outline for the report and save it as {draft_path}."
+                ))
+            ]
+        }, config)
+
+    return draft_outline
+
+def create_research_team_invoke_node(research_graph, speculator: Speculator = None,
+                                     pipeline: ResearchPipeline = None):
+    def call_research_team(state: State, config: RunnableConfig) -> Command[Literal["supervisor"]]:
         logger.info(f"call_research_team called, state: {state}")
         if research_graph is None:
             logger.error("research_graph is None, cannot call invoke method")
@@ -176,14 +321,25 @@ def create_research_team_invoke_node(research_graph):
                 goto=END, # Cannot be handled by supervisor node, can only end
             )
             
+        run_id, _ = findings_scope(config)
+        speculation = speculator.take(state, "research_team", config) if speculator is not None else None
+        if pipeline is not None:
+            if speculation is not None:
+                # What the committed speculative run published, and will publish, belongs to this run
+                pipeline.board.adopt(run_id, speculation.id)
+            # Draft the outline from partial findings while research runs
+            pipeline.start(run_id, state["messages"][-1].content, config)
         try:
-            logger.info(f"Calling research_graph.invoke, input: {state['messages'][-1]}")
-            response = research_graph.invoke({"messages": state["messages"][-1]})
+            if speculation is None:
+                logger.info(f"Calling research_graph, input: {state['messages'][-1]}")
+            # A budget running out mid-research still hands the partial result back to the supervisor
+            messages = _invoke_worker(research_graph, _team_input(state), speculation)
+            handoff_note = pipeline.finish(run_id) if pipeline is not None else ""
             return Command(
                 update={
                     "messages": [
                         HumanMessage(
-                            content=response["messages"][-1].content, name="research_team"
+                            content=messages[-1].content + handoff_note, name="research_team"
                         )
                     ]
                 },
@@ -191,6 +347,8 @@ def create_research_team_invoke_node(research_graph):
             )
         except Exception as e:
             logger.error(f"Error calling research_graph.invoke: {str(e)}", exc_info=True)
+            if pipeline is not None:
+                pipeline.finish(run_id)
             return Command(
                 update={
                     "messages": [
@@ -220,14 +378,19 @@ def create_writing_team_invoke_node(writing_graph):
             )
             
         try:
-            logger.info(f"Calling writing_graph.invoke, input: {state['messages'][-1]}")
-            response = writing_graph.invoke({"messages": state["messages"][-1]})
-            logger.info(f"writing_graph.invoke call result: {response}")
+            logger.info(f"Calling writing_graph, input: {state['messages'][-1]}")
+            messages = _invoke_worker(writing_graph, _team_input(state))
+            logger.info(f"writing_graph call result: {messages[-1]}")
+            saved_documents = [
+                file_name for message in messages
+                for file_name in (getattr(message, "additional_kwargs", None) or {}).get(SAVED_DOCUMENTS_KEY, [])
+            ]
             return Command(
                 update={
                     "messages": [
                         HumanMessage(
-                            content=response["messages"][-1].content, name="writing_team"
+                            content=messages[-1].content, name="writing_team",
+                            additional_kwargs={SAVED_DOCUMENTS_KEY: list(dict.fromkeys(saved_documents))},
                         )
                     ]
                 },
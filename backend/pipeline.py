@@ -0,0 +1,220 @@
+# coding: utf-8
+"""Pipelined handoff between the research and writing teams
+
+Research workers publish each result to the session's `FindingsBoard` as soon
+as they report back. While research continues, a `ResearchPipeline` waits for
+the first findings and has a note-taking agent draft an outline from them.
+When research completes, its result is handed to the writing team together
+with a note pointing to the draft, so the document writer can reconcile the
+draft with the complete findings instead of starting from nothing.
+
+A session can serve several runs at once, so findings and drafts are kept per
+run, keyed by the `run_id` of the run config. Drafts are written to a hidden
+directory of the working directory and removed with the run's findings when
+the run ends (`discard_run`). The drafter is detached from the research node
+like a speculative run: it keeps the run's budgets and timeline but streams
+nothing to the client, and the handoff never waits long for it.
+"""
+
+import time
+import shutil
+import logging
+import weakref
+import threading
+import contextvars
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DRAFT_OUTLINE_FILE = "draft_outline.txt"
+# Hidden directory of the working directory holding the drafts of running runs
+DRAFTS_DIR_NAME = ".drafts"
+# Appended to the research result; routing rules recognize the handoff by it
+HANDOFF_MARKER = "[Pipelined draft outline]"
+# How long the handoff waits for a draft still in progress when research completes
+DEFAULT_DRAFT_WAIT_SECONDS = 10.0
+
+
+def handoff_note(draft_path: str) -> str:
+    return (
+        f"\n\n{HANDOFF_MARKER} While research was running, an outline was drafted from partial findings"
+        f" and saved to {draft_path}. Reconcile it with the complete findings above: keep what they"
+        " support, fix what they contradict and add what is missing, then write the report."
+    )
+
+
+def findings_scope(config: Optional[dict]) -> Tuple[Optional[str], Optional[str]]:
+    """(run id, speculation id) a research worker running with `config` publishes under"""
+    configurable = (config or {}).get("configurable") or {}
+    return configurable.get("run_id"), configurable.get("speculation_id")
+
+
+class Finding:
+    def __init__(self, source: str, content: str):
+        self.source = source
+        self.content = content
+        self.published_at = time.time()
+
+
+class FindingsBoard:
+    """Research findings of a session's runs, published incrementally while research runs
+
+    Findings are scoped by `findings_scope(config)`. A speculative research run
+    publishes under its own speculation id, so its findings only become the
+    run's findings once the speculation is committed (`adopt`); those of a
+    cancelled speculation are dropped with the run.
+    """
+
+    def __init__(self):
+        self._findings: Dict[tuple, List[Finding]] = {}
+        self._closed = set()
+        # Scopes of committed speculations mapped to their run's scope
+        self._aliases: Dict[tuple, tuple] = {}
+        self._condition = threading.Condition()
+
+    def publish(self, scope: tuple, source: str, content: str):
+        with self._condition:
+            scope = self._aliases.get(scope, scope)
+            self._findings.setdefault(scope, []).append(Finding(source, content))
+            self._condition.notify_all()
+        logger.info(f"Finding published by {source} ({len(content)} characters)")
+
+    def adopt(self, run_id: Optional[str], speculation_id: str):
+        """Make the findings of a committed speculation, past and future, findings of its run"""
+        scope, run_scope = (run_id, speculation_id), (run_id, None)
+        with self._condition:
+            self._findings.setdefault(run_scope, []).extend(self._findings.pop(scope, []))
+            self._aliases[scope] = run_scope
+            self._condition.notify_all()
+
+    def close(self, run_id: Optional[str]):
+        """Mark the run's research as complete, waking up anyone waiting for findings"""
+        with self._condition:
+            self._closed.add(run_id)
+            self._condition.notify_all()
+
+    def wait_for(self, run_id: Optional[str], count: int, timeout: Optional[float] = None) -> List[Finding]:
+        """Block until the run has `count` findings or its research is complete, return its findings so far"""
+        scope = (run_id, None)
+        with self._condition:
+            self._condition.wait_for(
+                lambda: len(self._findings.get(scope, [])) >= count or run_id in self._closed, timeout
+            )
+            return list(self._findings.get(scope, []))
+
+    def snapshot(self, run_id: Optional[str]) -> List[Finding]:
+        with self._condition:
+            return list(self._findings.get((run_id, None), []))
+
+    def reset(self, run_id: Optional[str]):
+        """Consume the run's findings, a later research round of the run starts from an empty board"""
+        with self._condition:
+            self._findings.pop((run_id, None), None)
+            self._closed.discard(run_id)
+
+    def discard(self, run_id: Optional[str]):
+        """Drop everything of a run, including the findings of speculations never committed"""
+        with self._condition:
+            for scope in [scope for scope in self._findings if scope[0] == run_id]:
+                del self._findings[scope]
+            for scope in [scope for scope in self._aliases if scope[0] == run_id]:
+                del self._aliases[scope]
+            self._closed.discard(run_id)
+
+
+def render_findings(findings: List[Finding]) -> str:
+    return "\n\n".join(f"Finding {index + 1} ({finding.source}):\n{finding.content}"
+                       for index, finding in enumerate(findings))
+
+
+# Every pipeline, so the end of a run can drop its findings and drafts
+_pipelines: "weakref.WeakSet[ResearchPipeline]" = weakref.WeakSet()
+
+
+class ResearchPipeline:
+    """Drafts an outline from partial findings in parallel with the research team
+
+    `drafter(query, findings_text, draft_path, config)` runs the note-taking
+    agent with `config` and is expected to save the outline to `draft_path`,
+    relative to `working_dir`. A draft not ready `draft_wait` seconds after
+    research completes is left out of the handoff.
+    """
+
+    def __init__(self, board: FindingsBoard, drafter: Callable[[str, str, str, dict], None], working_dir: Path,
+                 min_findings: int = 1, draft_wait: float = DEFAULT_DRAFT_WAIT_SECONDS):
+        self.board = board
+        self.drafter = drafter
+        self.working_dir = Path(working_dir)
+        self.min_findings = min_findings
+        self.draft_wait = draft_wait
+        self._threads: Dict[Optional[str], threading.Thread] = {}
+        self._lock = threading.Lock()
+        _pipelines.add(self)
+
+    @staticmethod
+    def _run_dir(run_id: Optional[str]) -> str:
+        return f"{DRAFTS_DIR_NAME}/{run_id or 'default'}"
+
+    def draft_path(self, run_id: Optional[str]) -> str:
+        """Path of the run's draft outline, relative to the working directory"""
+        return f"{self._run_dir(run_id)}/{DRAFT_OUTLINE_FILE}"
+
+    def start(self, run_id: Optional[str], query: str, config: Optional[dict] = None):
+        """Start drafting in the background, called by the research node running with `config`
+
+        The board is not cleared here: a committed speculative research run may
+        already have published findings for this query.
+        """
+        from speculation import detached_config
+
+        draft = self.working_dir / self.draft_path(run_id)
+        draft.parent.mkdir(parents=True, exist_ok=True)
+        draft.unlink(missing_ok=True)
+        # A fresh context, the caller's would nest the drafter under the research node and its stream
+        drafter_config = detached_config(config, "outline_drafter", "pipelined")
+        thread = threading.Thread(
+            target=contextvars.Context().run, args=(self._draft, run_id, query, drafter_config),
+            name="outline-drafter", daemon=True,
+        )
+        with self._lock:
+            self._threads[run_id] = thread
+        thread.start()
+
+    def _draft(self, run_id: Optional[str], query: str, config: dict):
+        findings = self.board.wait_for(run_id, self.min_findings)
+        if not findings:
+            logger.info("Research completed without findings, no outline drafted")
+            return
+        logger.info(f"Drafting outline from {len(findings)} partial findings")
+        try:
+            self.drafter(query, render_findings(findings), self.draft_path(run_id), config)
+        except Exception as e:
+            logger.error(f"Error drafting outline from partial findings: {str(e)}", exc_info=True)
+
+    def finish(self, run_id: Optional[str]) -> str:
+        """Close the run's board after research, return the handoff note if the draft is ready in time"""
+        self.board.close(run_id)
+        with self._lock:
+            thread = self._threads.pop(run_id, None)
+        if thread is not None:
+            thread.join(self.draft_wait)
+        self.board.reset(run_id)
+        if thread is not None and thread.is_alive():
+            # The writing team starts without it, a late draft is removed with the run
+            logger.info(f"Outline draft not ready after {self.draft_wait:.0f}s, handing off without it")
+            return ""
+        if (self.working_dir / self.draft_path(run_id)).exists():
+            return handoff_note(self.draft_path(run_id))
+        return ""
+
+    def discard_run(self, run_id: Optional[str]):
+        """Drop the run's findings and drafts once the run has ended"""
+        self.board.discard(run_id)
+        shutil.rmtree(self.working_dir / self._run_dir(run_id), ignore_errors=True)
+
+
+def discard_run(run_id: Optional[str]):
+    """Drop what the pipelines of all sessions kept for a finished run"""
+    for pipeline in list(_pipelines):
+        pipeline.discard_run(run_id)
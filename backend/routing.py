@@ -0,0 +1,272 @@
+# coding: utf-8
+
+import logging
+import re
+import threading
+from collections import Counter, defaultdict
+from typing import Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# A rule looks at the graph state and the supervisor's members and returns the
+# worker to route to (or "FINISH"), or None when it has no opinion.
+RoutingRule = Callable[[dict, List[str]], Optional[str]]
+# A classifier returns its best label together with a confidence in [0, 1].
+RoutingClassifier = Callable[[dict, List[str]], Tuple[str, float]]
+
+ROUTING_PATHS = ("rule", "classifier", "llm")
+
+
+class RoutingStats:
+    """Thread-safe counters of which path produced each routing decision"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts: Dict[str, Counter] = defaultdict(Counter)
+
+    def record(self, supervisor: str, path: str):
+        with self._lock:
+            self._counts[supervisor][path] += 1
+
+    def reset(self):
+        with self._lock:
+            self._counts.clear()
+
+    def snapshot(self) -> dict:
+        """Return per-supervisor counts and the number of LLM round trips saved"""
+        with self._lock:
+            supervisors = {
+                name: {path: counts.get(path, 0) for path in ROUTING_PATHS}
+                for name, counts in self._counts.items()
+            }
+        totals = {path: sum(s[path] for s in supervisors.values()) for path in ROUTING_PATHS}
+        return {
+            "supervisors": supervisors,
+            "totals": totals,
+            "saved_llm_calls": totals["rule"] + totals["classifier"],
+        }
+
+
+# Process-wide statistics shared by all sessions
+routing_stats = RoutingStats()
+
+
+def _last_message(state: dict):
+    messages = state.get("messages") or []
+    return messages[-1] if messages else None
+
+
+def route_fresh_query_to(member: str) -> RoutingRule:
+    """Route to `member` when the only message in the state is the user's query"""
+
+    def rule(state: dict, members: List[str]) -> Optional[str]:
+        messages = state.get("messages") or []
+        if member not in members or len(messages) != 1:
+            return None
+        message = messages[0]
+        if getattr(message, "type", None) == "human" and not getattr(message, "name", None):
+            return member
+        return None
+
+    return rule
+
+
+# Key of a worker report's additional_kwargs listing the documents its tools saved
+SAVED_DOCUMENTS_KEY = "saved_documents"
+
+_FAILURE_PATTERN = re.compile(
+    r"^\s*error\b|\b(could not|couldn't|cannot|can't|unable to|failed to|not (been )?(saved|written))\b",
+    re.IGNORECASE,
+)
+
+
+def finish_after_saved_document(member: str) -> RoutingRule:
+    """Finish when `member` reports back that a final document was saved
+
+    Relies on the files recorded under SAVED_DOCUMENTS_KEY from successful
+    document tool calls, so outlines, failed writes and mere mentions of saving
+    do not count. A report that still sounds like a failure is left to the LLM.
+    """
+
+    def rule(state: dict, members: List[str]) -> Optional[str]:
+        message = _last_message(state)
+        if message is None or getattr(message, "name", None) != member:
+            return None
+        if not (getattr(message, "additional_kwargs", None) or {}).get(SAVED_DOCUMENTS_KEY):
+            return None
+        content = message.content if isinstance(message.content, str) else str(message.content)
+        if _FAILURE_PATTERN.search(content):
+            return None
+        return "FINISH"
+
+    return rule
+
+
+def route_new_task_to(member: str) -> RoutingRule:
+    """Route to `member` when the last message is a task from outside the team, not a member's report"""
+
+    def rule(state: dict, members: List[str]) -> Optional[str]:
+        message = _last_message(state)
+        if member not in members or message is None or getattr(message, "name", None) in members:
+            return None
+        return member
+
+    return rule
+
+
+def predict_with(classifier: RoutingClassifier, min_confidence: float = 0.5) -> RoutingRule:
+    """The classifier's label at a lower confidence than the fast path trusts, to predict for speculation"""
+
+    def rule(state: dict, members: List[str]) -> Optional[str]:
+        label, confidence = classifier(state, members)
+        return label if label and confidence >= min_confidence else None
+
+    return rule
+
+
+def route_after_handoff(sender: str, member: str, marker: str) -> RoutingRule:
+    """Route to `member` when the last message is from `sender` and carries a handoff `marker`"""
+
+    def rule(state: dict, members: List[str]) -> Optional[str]:
+        message = _last_message(state)
+        if member not in members or message is None or getattr(message, "name", None) != sender:
+            return None
+        content = message.content if isinstance(message.content, str) else str(message.content)
+        return member if marker in content else None
+
+    return rule
+
+
+class KeywordClassifier:
+    """Tiny local classifier scoring the last message against per-label keywords
+
+    Confidence is the share of keyword hits that belong to the best label, so a
+    message mentioning keywords of several labels falls back to the LLM router.
+    Only incoming tasks are classified, reports of the members themselves are
+    left to the LLM router.
+    """
+
+    def __init__(self, keywords: Dict[str, List[str]]):
+        self.patterns = {
+            label: [re.compile(rf"\b{re.escape(word)}\b", re.IGNORECASE) for word in words]
+            for label, words in keywords.items()
+        }
+
+    def __call__(self, state: dict, members: List[str]) -> Tuple[str, float]:
+        message = _last_message(state)
+        if message is None or getattr(message, "name", None) in members:
+            return "", 0.0
+        content = message.content if isinstance(message.content, str) else str(message.content)
+        scores = {
+            label: sum(1 for pattern in patterns if pattern.search(content))
+            for label, patterns in self.patterns.items()
+            if label in members or label == "FINISH"
+        }
+        total = sum(scores.values())
+        if total == 0:
+            return "", 0.0
+        label = max(scores, key=scores.get)
+        return label, scores[label] / total
+
+
+class RoutingPolicy:
+    """Deterministic fast path consulted before the LLM router
+
+    Rules are tried in order and the first one returning a valid option wins.
+    The optional classifier is only trusted at or above `confidence_threshold`.
+    When neither is confident, `decide` returns None and the caller falls back
+    to the LLM router, recording it via `record_llm`.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        rules: Optional[List[RoutingRule]] = None,
+        classifier: Optional[RoutingClassifier] = None,
+        confidence_threshold: float = 0.9,
+        stats: Optional[RoutingStats] = None,
+    ):
+        self.name = name
+        self.rules = list(rules or [])
+        self.classifier = classifier
+        self.confidence_threshold = confidence_threshold
+        self.stats = stats if stats is not None else routing_stats
+
+    def decide(self, state: dict, members: List[str]) -> Optional[str]:
+        options = ["FINISH"] + list(members)
+
+        for rule in self.rules:
+            try:
+                decision = rule(state, members)
+            except Exception as e:
+                logger.warning(f"Routing rule {getattr(rule, '__qualname__', rule)} failed: {str(e)}")
+                continue
+            if decision in options:
+                logger.info(f"[{self.name}] Rule-based routing decision: {decision}")
+                self.stats.record(self.name, "rule")
+                return decision
+
+        if self.classifier is not None:
+            try:
+                label, confidence = self.classifier(state, members)
+            except Exception as e:
+                logger.warning(f"Routing classifier failed: {str(e)}")
+                label, confidence = "", 0.0
+            if label in options and confidence >= self.confidence_threshold:
+                logger.info(f"[{self.name}] Classifier routing decision: {label} ({confidence:.2f})")
+                self.stats.record(self.name, "classifier")
+                return label
+
+        return None
+
+    def record_llm(self):
+        self.stats.record(self.name, "llm")
+
+
+# Keywords of tasks entering the research team
+RESEARCH_TEAM_KEYWORDS = {
+    "search": ["search", "find", "look up", "latest", "news", "recent", "compare", "overview"],
+    "web_scraper": ["url", "http", "https", "www", "webpage", "web page", "scrape", "website", "link"],
+}
+
+
+def build_research_team_policy() -> RoutingPolicy:
+    """Default policy for the research team supervisor: keyword classification of incoming tasks"""
+    return RoutingPolicy("research_team", classifier=KeywordClassifier(RESEARCH_TEAM_KEYWORDS))
+
+
+def build_research_team_predictors() -> List[RoutingRule]:
+    """Speculation predictors for the research team supervisor
+
+    Used when the fast path could not decide: the classifier's weaker guess,
+    else search for any new task. Reports of the workers are not predicted.
+    """
+    return [predict_with(KeywordClassifier(RESEARCH_TEAM_KEYWORDS)), route_new_task_to("search")]
+
+
+def build_writing_team_policy(handoff_marker: Optional[str] = None) -> RoutingPolicy:
+    """Default policy for the writing team supervisor
+
+    The team is done once doc_writer reports a saved document. With a
+    pipelined handoff, research results carrying `handoff_marker` come with a
+    draft outline and go straight to doc_writer.
+    """
+    rules = [finish_after_saved_document("doc_writer")]
+    if handoff_marker:
+        rules.append(route_after_handoff("research_team", "doc_writer", handoff_marker))
+    return RoutingPolicy("writing_team", rules=rules)
+
+
+def build_super_team_policy(handoff_marker: Optional[str] = None) -> RoutingPolicy:
+    """Default policy for the top-level supervisor
+
+    With a pipelined research to writing handoff, research results carrying
+    `handoff_marker` go straight to the writing team.
+    """
+    rules = [
+        route_fresh_query_to("research_team"),
+        finish_after_saved_document("writing_team"),
+    ]
+    if handoff_marker:
+        rules.append(route_after_handoff("research_team", "writing_team", handoff_marker))
+    return RoutingPolicy("super_team", rules=rules)
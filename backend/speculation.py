@@ -0,0 +1,288 @@
+# coding: utf-8
+"""Speculative execution of the next member while a supervisor asks its LLM
+
+When a supervisor falls through to its LLM router, a `Speculator` can predict
+the next member with routing rules and start that member's graph right away in
+a background thread. If the router agrees, the member's node picks up the
+speculative result instead of starting from scratch; otherwise the speculation
+is cancelled between graph steps and its runtime is counted as wasted work.
+
+The speculative run is detached from the supervisor node: it gets the run's
+callbacks (budgets, timelines, cassettes) except the message stream, so a
+cancelled run never streams tokens to the client, and a checkpoint namespace
+placing it where the member would run, so timelines and per-node statistics
+attribute its work to the member. Committed results nobody took are dropped
+when the run ends (`discard_run`).
+"""
+
+import time
+import uuid
+import logging
+import weakref
+import threading
+import contextvars
+from typing import Any, Callable, Dict, List, Optional
+
+from routing import RoutingRule
+
+logger = logging.getLogger(__name__)
+
+# Callback handlers not handed to speculative runs: LangGraph's handler streaming
+# LLM tokens to the client. Matched by name, its module moved between versions.
+DETACHED_HANDLERS = ("StreamMessagesHandler",)
+
+
+class SpeculationStats:
+    """Thread-safe hit/miss counters and time saved or wasted by speculation"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = 0
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+        self.wasted_seconds = 0.0
+
+    def record_start(self):
+        with self._lock:
+            self.started += 1
+
+    def record_hit(self, saved_seconds: float):
+        with self._lock:
+            self.hits += 1
+            self.saved_seconds += saved_seconds
+
+    def record_miss(self, wasted_seconds: float):
+        with self._lock:
+            self.misses += 1
+            self.wasted_seconds += wasted_seconds
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            resolved = self.hits + self.misses
+            return {
+                "started": self.started,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / resolved, 4) if resolved else None,
+                "saved_seconds": round(self.saved_seconds, 3),
+                "wasted_seconds": round(self.wasted_seconds, 3),
+            }
+
+
+# Process-wide statistics shared by all sessions
+speculation_stats = SpeculationStats()
+
+
+def _team_input(state: dict) -> dict:
+    # Same input as create_research_team_invoke_node and create_writing_team_invoke_node
+    return {"messages": [state["messages"][-1]]}
+
+
+def detached_config(config: Optional[dict], node: str, task: str) -> dict:
+    """Config for a graph or agent run in the background on behalf of a node running with `config`
+
+    The run keeps the run's callbacks except DETACHED_HANDLERS, so it streams
+    nothing to the client, and the run-level configurable values. Its checkpoint
+    namespace is "<parent>|<node>:<task>", a sibling of the calling node.
+    """
+    from langchain_core.callbacks import CallbackManager
+
+    config = config or {}
+    manager = config.get("callbacks")
+    handlers = getattr(manager, "inheritable_handlers", manager) or []
+    handlers = [handler for handler in handlers if type(handler).__name__ not in DETACHED_HANDLERS]
+    callbacks = CallbackManager(
+        handlers=handlers, inheritable_handlers=handlers, parent_run_id=getattr(manager, "parent_run_id", None)
+    )
+    configurable = config.get("configurable") or {}
+    # The caller's namespace is "<parent>|<caller>:<task>"
+    namespace = configurable.get("checkpoint_ns", "")
+    parent = namespace.rsplit("|", 1)[0] if "|" in namespace else ""
+    return {
+        "callbacks": callbacks,
+        "recursion_limit": config.get("recursion_limit", 25),
+        "configurable": dict(
+            # LangGraph's own keys belong to the caller's task, only run-level values carry over
+            {key: value for key, value in configurable.items()
+             if not key.startswith("__") and not key.startswith("checkpoint")},
+            checkpoint_ns=f"{parent}|{node}:{task}" if parent else f"{node}:{task}",
+        ),
+    }
+
+
+def speculative_config(config: Optional[dict], member: str, speculation_id: str) -> dict:
+    """Config for a speculative run of `member`, started from a sibling node with `config`
+
+    Detached like `detached_config`, placed where the member would run, with
+    "speculation_id" set so per-run state written by the speculative run can be
+    told apart until it is committed (see pipeline.FindingsBoard).
+    """
+    config = detached_config(config, member, "speculative")
+    config["configurable"]["speculation_id"] = speculation_id
+    return config
+
+
+class Speculation:
+    """One member graph run started ahead of the routing decision"""
+
+    def __init__(self, member: str, graph, graph_input: dict, key: tuple, config: Optional[dict] = None,
+                 speculation_id: Optional[str] = None):
+        self.id = speculation_id or uuid.uuid4().hex
+        self.member = member
+        self.key = key
+        self.graph = graph
+        self.graph_input = graph_input
+        self.config = config
+        self.started_at = time.perf_counter()
+        self.finished_at: Optional[float] = None
+        # Latest state of the run, the partial result if it fails
+        self.last_state: Optional[dict] = None
+        self._cancelled = threading.Event()
+        self._result: Optional[dict] = None
+        self._error: Optional[BaseException] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        # A fresh context, the caller's would nest the run under the calling node
+        context = contextvars.Context()
+        self._thread = threading.Thread(
+            target=context.run, args=(self._run,), name=f"speculative-{self.member}", daemon=True
+        )
+        self._thread.start()
+
+    def _run(self):
+        try:
+            for state in self.graph.stream(self.graph_input, self.config, stream_mode="values"):
+                self.last_state = state
+                # Cooperative cancellation, the step in progress always completes
+                if self._cancelled.is_set():
+                    logger.info(f"Speculative {self.member} run cancelled")
+                    return
+            self._result = self.last_state
+        except BaseException as e:
+            self._error = e
+        finally:
+            self.finished_at = time.perf_counter()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def elapsed(self) -> float:
+        return (self.finished_at or time.perf_counter()) - self.started_at
+
+    def wait(self):
+        self._thread.join()
+
+    def result(self) -> dict:
+        """Wait for the run to finish and return its final state, re-raising its error"""
+        self.wait()
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+
+# Every speculator, so the end of a run can drop what its nodes did not take
+_speculators: "weakref.WeakSet[Speculator]" = weakref.WeakSet()
+
+
+class Speculator:
+    """Starts likely next members early and hands committed results to their nodes
+
+    `predictors` are routing rules; the first prediction naming a member in
+    `graphs` is started. `inputs` maps members to a function building their
+    graph input from the supervisor's state, by default the last message as
+    the team invoke nodes pass it; it must match what the member's node would
+    pass to the same graph. Targets can also be added with `add_target`.
+    """
+
+    def __init__(
+        self,
+        predictors: List[RoutingRule],
+        graphs: Optional[Dict[str, Any]] = None,
+        inputs: Optional[Dict[str, Callable[[dict], dict]]] = None,
+        stats: Optional[SpeculationStats] = None,
+    ):
+        self.predictors = list(predictors)
+        self.graphs = dict(graphs or {})
+        self.inputs = dict(inputs or {})
+        self.stats = stats if stats is not None else speculation_stats
+        self._committed: Dict[tuple, Speculation] = {}
+        self._lock = threading.Lock()
+        _speculators.add(self)
+
+    def add_target(self, member: str, graph, graph_input: Optional[Callable[[dict], dict]] = None):
+        self.graphs[member] = graph
+        if graph_input is not None:
+            self.inputs[member] = graph_input
+
+    @staticmethod
+    def _key(state: dict, member: str, config: Optional[dict]) -> tuple:
+        run_id = ((config or {}).get("configurable") or {}).get("run_id")
+        messages = state.get("messages") or []
+        last = messages[-1] if messages else None
+        return run_id, member, len(messages), getattr(last, "id", None) or id(last)
+
+    def start(self, state: dict, members: List[str], config: Optional[dict] = None) -> Optional[Speculation]:
+        for predictor in self.predictors:
+            try:
+                member = predictor(state, members)
+            except Exception as e:
+                logger.warning(f"Speculation predictor failed: {str(e)}")
+                continue
+            if member in self.graphs:
+                graph_input = self.inputs.get(member, _team_input)(state)
+                speculation_id = uuid.uuid4().hex
+                speculation = Speculation(
+                    member, self.graphs[member], graph_input, self._key(state, member, config),
+                    speculative_config(config, member, speculation_id), speculation_id,
+                )
+                speculation.start()
+                self.stats.record_start()
+                logger.info(f"Started speculative {member} run")
+                return speculation
+        return None
+
+    def resolve(self, speculation: Speculation, decision: Optional[str]):
+        """Commit the speculation if the router chose its member, else cancel it"""
+        if decision == speculation.member:
+            # Time the member had already been running when the router answered
+            saved = speculation.elapsed()
+            with self._lock:
+                self._committed[speculation.key] = speculation
+            self.stats.record_hit(saved)
+            logger.info(f"Speculative {speculation.member} run committed, {saved:.2f}s ahead")
+        else:
+            self._cancel(speculation)
+            logger.info(f"Router chose {decision}, cancelling speculative {speculation.member} run")
+
+    def _cancel(self, speculation: Speculation):
+        speculation.cancel()
+        threading.Thread(
+            target=self._record_waste, args=(speculation,), name="speculation-waste", daemon=True
+        ).start()
+
+    def _record_waste(self, speculation: Speculation):
+        speculation.wait()
+        self.stats.record_miss(speculation.elapsed())
+
+    def take(self, state: dict, member: str, config: Optional[dict] = None) -> Optional[Speculation]:
+        """The committed speculation of `member` for this state, if any"""
+        with self._lock:
+            return self._committed.pop(self._key(state, member, config), None)
+
+    def discard_run(self, run_id: Optional[str]):
+        """Cancel and drop the committed speculations of a run that no node took"""
+        with self._lock:
+            keys = [key for key in self._committed if key[0] == run_id]
+            stale = [self._committed.pop(key) for key in keys]
+        for speculation in stale:
+            # Already counted as a hit when it was committed
+            logger.info(f"Dropping untaken speculative {speculation.member} run")
+            speculation.cancel()
+
+
+def discard_run(run_id: Optional[str]):
+    """Drop what the speculators of all sessions committed for a finished run"""
+    for speculator in list(_speculators):
+        speculator.discard_run(run_id)
@@ -0,0 +1,182 @@
+# coding: utf-8
+"""Local stand-in for the OpenAI chat completions API with simulated rate limits
+
+Serves POST /v1/chat/completions, plain and streamed, with canned answers:
+text for normal calls, and a tool call with schema-conforming arguments when a
+tool call is required (supervisor routers answer FINISH). Requests and tokens
+are rate limited per API key; over the limit it answers 429 with Retry-After
+like the real API. Point a model endpoint at it to exercise the dispatcher:
+
+    python stub_provider.py --port 8100 --rpm 20 --tpm 20000
+    # models.json: "endpoints": [{"base_url": "http://127.0.0.1:8100/v1", "api_key_env": "STUB_KEY_1"}, ...]
+
+GET /stats reports requests and 429s per key.
+"""
+
+import json
+import time
+import uuid
+import random
+import asyncio
+import argparse
+from collections import defaultdict
+from typing import Any, Dict, Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from dispatcher import TokenBucket
+
+
+def _estimate_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+def _example_value(schema: Dict[str, Any]) -> Any:
+    """A value conforming to a JSON schema, routers choose FINISH so runs terminate"""
+    if "enum" in schema:
+        return "FINISH" if "FINISH" in schema["enum"] else schema["enum"][0]
+    if "anyOf" in schema:
+        return _example_value(schema["anyOf"][0])
+    kind = schema.get("type")
+    if kind == "object":
+        properties = schema.get("properties", {})
+        return {name: _example_value(properties[name]) for name in schema.get("required", properties)}
+    if kind == "array":
+        return []
+    if kind in ("integer", "number"):
+        return 0
+    if kind == "boolean":
+        return False
+    return "stub"
+
+
+def _tool_call(body: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    tools = body.get("tools") or []
+    tool_choice = body.get("tool_choice", "auto")
+    if not tools or tool_choice in ("auto", "none"):
+        return None
+    function = tools[0]["function"]
+    if isinstance(tool_choice, dict):
+        name = tool_choice["function"]["name"]
+        function = next(tool["function"] for tool in tools if tool["function"]["name"] == name)
+    return {
+        "id": f"call_{uuid.uuid4().hex[:24]}",
+        "type": "function",
+        "function": {
+            "name": function["name"],
+            "arguments": json.dumps(_example_value(function.get("parameters", {"type": "object"}))),
+        },
+    }
+
+
+class StubProvider:
+    def __init__(self, rpm: Optional[float], tpm: Optional[float], latency: float = 0.0, rate_limit_ratio: float = 0.0):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.latency = latency
+        # Share of requests answered with 429 regardless of the budgets
+        self.rate_limit_ratio = rate_limit_ratio
+        self._buckets: Dict[str, tuple] = {}
+        self.stats = defaultdict(lambda: {"requests": 0, "rate_limited": 0})
+
+    def admit(self, key: str, tokens: int) -> float:
+        """0 if the request is admitted, else the seconds to put in Retry-After"""
+        if key not in self._buckets:
+            self._buckets[key] = (TokenBucket(self.rpm), TokenBucket(self.tpm))
+        request_bucket, token_bucket = self._buckets[key]
+        now = time.monotonic()
+        wait = max(request_bucket.wait_time(1, now), token_bucket.wait_time(tokens, now))
+        if wait == 0 and random.random() < self.rate_limit_ratio:
+            wait = 1.0
+        if wait > 0:
+            self.stats[key]["rate_limited"] += 1
+            return wait
+        request_bucket.take(1, now)
+        token_bucket.take(tokens, now)
+        self.stats[key]["requests"] += 1
+        return 0.0
+
+
+def create_app(provider: StubProvider) -> FastAPI:
+    app = FastAPI(title="Stub chat completions provider")
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        key = request.headers.get("authorization", "").removeprefix("Bearer ") or "anonymous"
+        prompt_tokens = sum(_estimate_tokens(str(message.get("content") or "")) for message in body["messages"])
+        retry_after = provider.admit(key, prompt_tokens + body.get("max_tokens", 256))
+        if retry_after:
+            return JSONResponse(
+                status_code=429,
+                headers={"retry-after": f"{retry_after:.3f}", "retry-after-ms": str(int(retry_after * 1000))},
+                content={"error": {
+                    "message": f"Rate limit reached for {body.get('model')}, please try again in {retry_after:.3f}s.",
+                    "type": "requests",
+                    "code": "rate_limit_exceeded",
+                }},
+            )
+
+        await asyncio.sleep(provider.latency)
+        tool_call = _tool_call(body)
+        content = None if tool_call else f"Stub answer from {body.get('model')}."
+        completion_tokens = _estimate_tokens(json.dumps(tool_call) if tool_call else content)
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        }
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        base = {"id": completion_id, "created": int(time.time()), "model": body.get("model")}
+        finish_reason = "tool_calls" if tool_call else "stop"
+
+        if not body.get("stream"):
+            message = {"role": "assistant", "content": content}
+            if tool_call:
+                message["tool_calls"] = [tool_call]
+            return dict(base, object="chat.completion", usage=usage, choices=[
+                {"index": 0, "message": message, "finish_reason": finish_reason}
+            ])
+
+        def chunk(delta: Dict[str, Any], finish: Optional[str] = None) -> str:
+            payload = dict(base, object="chat.completion.chunk", choices=[
+                {"index": 0, "delta": delta, "finish_reason": finish}
+            ])
+            return f"data: {json.dumps(payload)}\n\n"
+
+        def events():
+            yield chunk({"role": "assistant", "content": ""})
+            if tool_call:
+                yield chunk({"tool_calls": [dict(tool_call, index=0)]})
+            else:
+                for word in content.split(" "):
+                    yield chunk({"content": word + " "})
+            yield chunk({}, finish_reason)
+            if (body.get("stream_options") or {}).get("include_usage"):
+                yield f"data: {json.dumps(dict(base, object='chat.completion.chunk', choices=[], usage=usage))}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.get("/stats")
+    async def stats():
+        return dict(provider.stats)
+
+    return app
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Stub OpenAI-compatible provider with simulated rate limits")
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--rpm", type=float, default=None, help="Requests per minute per API key")
+    parser.add_argument("--tpm", type=float, default=None, help="Tokens per minute per API key")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds before answering")
+    parser.add_argument("--rate-limit-ratio", type=float, default=0.0, help="Share of requests rejected with 429 anyway")
+    args = parser.parse_args()
+
+    stub = StubProvider(args.rpm, args.tpm, args.latency, args.rate_limit_ratio)
+    uvicorn.run(create_app(stub), host=args.host, port=args.port)
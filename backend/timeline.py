@@ -0,0 +1,387 @@
+# coding: utf-8
+"""Per-run execution timelines
+
+`RunTimeline` is a callback handler turning the callbacks of a run into a tree
+of spans: super-team steps, team supervisors, workers, nested agent steps, LLM
+calls and tool calls, each with start/end, tokens and bytes. Finished
+timelines are kept in a bounded `TimelineStore` and can be exported as Chrome
+trace-event JSON (chrome://tracing, Perfetto). An optional `SamplingProfiler`
+attaches the hottest Python frames of the threads working on the run.
+
+LLM spans also record how many input tokens the provider served from its
+prompt cache. They are summed per "<team>.<node>" for each run and, across
+runs, in the process-wide `prompt_cache_stats`.
+"""
+
+import os
+import sys
+import time
+import uuid
+import logging
+import threading
+from collections import Counter, OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+
+logger = logging.getLogger(__name__)
+
+
+class Span:
+    def __init__(self, span_id: str, parent_id: Optional[str], name: str, kind: str, start: float, thread_id: int):
+        self.id = span_id
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.start = start
+        self.end: Optional[float] = None
+        self.thread_id = thread_id
+        self.status = "running"
+        self.attributes: Dict[str, Any] = {}
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "kind": self.kind,
+            "start": round(self.start, 6),
+            "end": round(self.end, 6) if self.end is not None else None,
+            "duration": round(self.end - self.start, 6) if self.end is not None else None,
+            "status": self.status,
+            "attributes": self.attributes,
+        }
+
+
+def _node_kind(node: str, checkpoint_ns: str) -> str:
+    # Namespaces nest with "|": "research_team:<id>|supervisor:<id>" is one level deep
+    depth = checkpoint_ns.count("|") if checkpoint_ns else 0
+    if depth == 0:
+        return "super_supervisor" if node == "supervisor" else "super_step"
+    if depth == 1:
+        return "team_supervisor" if node == "supervisor" else "worker"
+    return "agent_step"
+
+
+def _node_label(node: str, checkpoint_ns: str) -> str:
+    """The "<team>.<node>" an LLM call belongs to, as used by the model configuration"""
+    names = [part.split(":", 1)[0] for part in checkpoint_ns.split("|")] if checkpoint_ns else []
+    if len(names) >= 2:
+        return f"{names[0]}.{names[1]}"
+    return f"super_team.{names[0] if names else node}"
+
+
+class PromptCacheStats:
+    """Thread-safe per-node counts of input tokens and input tokens read from the provider's prompt cache"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._nodes: Dict[str, Dict[str, int]] = {}
+
+    def record(self, node: str, input_tokens: int, cached_tokens: int):
+        with self._lock:
+            counts = self._nodes.setdefault(node, {"calls": 0, "input_tokens": 0, "cached_tokens": 0})
+            counts["calls"] += 1
+            counts["input_tokens"] += input_tokens
+            counts["cached_tokens"] += cached_tokens
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {
+                node: dict(counts, hit_ratio=round(counts["cached_tokens"] / counts["input_tokens"], 4)
+                           if counts["input_tokens"] else None)
+                for node, counts in sorted(self._nodes.items())
+            }
+
+
+# Process-wide statistics shared by all sessions
+prompt_cache_stats = PromptCacheStats()
+
+
+class RunTimeline(BaseCallbackHandler):
+    """Builds the span tree of one run from its callbacks"""
+
+    # Record spans in the thread that runs the node, LLM or tool
+    run_inline = True
+
+    def __init__(self, run_id: Optional[str] = None, query: str = ""):
+        self.run_id = run_id or str(uuid.uuid4())
+        self.query = query
+        self.started_at = time.time()
+        self._origin = time.perf_counter()
+        self.finished_at: Optional[float] = None
+        self.spans: Dict[str, Span] = {}
+        self.profile: Optional[Dict[str, Any]] = None
+        self._lock = threading.Lock()
+        # Every callback run id mapped to the span it belongs to, so nested runs find their parent span
+        self._span_of: Dict[UUID, Optional[str]] = {}
+        # Open spans per thread, the threads currently working on this run
+        self._open_spans: Counter = Counter()
+        self.prompt_cache = PromptCacheStats()
+
+    def _now(self) -> float:
+        return time.perf_counter() - self._origin
+
+    def _open(self, run_id: UUID, parent_run_id: Optional[UUID], name: str, kind: str) -> Span:
+        with self._lock:
+            parent_id = self._span_of.get(parent_run_id) if parent_run_id else None
+            span = Span(str(run_id), parent_id, name, kind, self._now(), threading.get_ident())
+            self.spans[span.id] = span
+            self._span_of[run_id] = span.id
+            self._open_spans[span.thread_id] += 1
+            return span
+
+    def _pass_through(self, run_id: UUID, parent_run_id: Optional[UUID]):
+        with self._lock:
+            self._span_of[run_id] = self._span_of.get(parent_run_id) if parent_run_id else None
+
+    def _close(self, run_id: UUID, status: str = "ok", **attributes: Any) -> Optional[Span]:
+        with self._lock:
+            span = self.spans.get(str(run_id))
+            if span is None or span.end is not None:
+                return None
+            span.end = self._now()
+            span.status = status
+            span.attributes.update(attributes)
+            self._open_spans[span.thread_id] -= 1
+            if self._open_spans[span.thread_id] <= 0:
+                del self._open_spans[span.thread_id]
+            return span
+
+    def active_threads(self) -> set:
+        """Ids of the threads with a running node, LLM or tool span of this run"""
+        with self._lock:
+            return set(self._open_spans)
+
+    def on_chain_start(self, serialized, inputs, *, run_id: UUID, parent_run_id: Optional[UUID] = None,
+                       metadata: Optional[dict] = None, **kwargs: Any):
+        metadata = metadata or {}
+        node = metadata.get("langgraph_node")
+        # Only the graph node itself becomes a span, not the runnables it is made of
+        if node and kwargs.get("name") == node:
+            kind = _node_kind(node, metadata.get("langgraph_checkpoint_ns", ""))
+            self._open(run_id, parent_run_id, node, kind)
+        else:
+            self._pass_through(run_id, parent_run_id)
+
+    def on_chain_end(self, outputs, *, run_id: UUID, **kwargs: Any):
+        self._close(run_id)
+
+    def on_chain_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any):
+        self._close(run_id, status="error", error=str(error))
+
+    def on_chat_model_start(self, serialized, messages, *, run_id: UUID, parent_run_id: Optional[UUID] = None,
+                            metadata: Optional[dict] = None, **kwargs: Any):
+        metadata = metadata or {}
+        model = metadata.get("ls_model_name") or "llm"
+        span = self._open(run_id, parent_run_id, model, "llm")
+        span.attributes["node"] = _node_label(metadata.get("langgraph_node", ""),
+                                              metadata.get("langgraph_checkpoint_ns", ""))
+        span.attributes["bytes_in"] = sum(len(str(m.content).encode("utf-8")) for batch in messages for m in batch)
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any):
+        attributes = {"input_tokens": 0, "cached_tokens": 0, "output_tokens": 0, "bytes_out": 0}
+        for generations in response.generations:
+            for generation in generations:
+                attributes["bytes_out"] += len(generation.text.encode("utf-8"))
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+                attributes["input_tokens"] += usage.get("input_tokens", 0)
+                attributes["cached_tokens"] += (usage.get("input_token_details") or {}).get("cache_read", 0)
+                attributes["output_tokens"] += usage.get("output_tokens", 0)
+        span = self._close(run_id, **attributes)
+        if span is not None and span.attributes.get("node"):
+            for stats in (self.prompt_cache, prompt_cache_stats):
+                stats.record(span.attributes["node"], attributes["input_tokens"], attributes["cached_tokens"])
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any):
+        self._close(run_id, status="error", error=str(error))
+
+    def on_tool_start(self, serialized, input_str: str, *, run_id: UUID, parent_run_id: Optional[UUID] = None,
+                      **kwargs: Any):
+        name = kwargs.get("name") or (serialized or {}).get("name", "tool")
+        span = self._open(run_id, parent_run_id, name, "tool")
+        span.attributes["bytes_in"] = len(str(input_str).encode("utf-8"))
+
+    def on_tool_end(self, output: Any, *, run_id: UUID, **kwargs: Any):
+        content = getattr(output, "content", output)
+        self._close(run_id, bytes_out=len(str(content).encode("utf-8")))
+
+    def on_tool_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any):
+        self._close(run_id, status="error", error=str(error))
+
+    def finish(self):
+        self.finished_at = time.time()
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            spans = [span.to_dict() for span in self.spans.values()]
+        spans.sort(key=lambda span: span["start"])
+        return {
+            "run_id": self.run_id,
+            "query": self.query,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "spans": spans,
+            "prompt_cache": self.prompt_cache.snapshot(),
+            "profile": self.profile,
+        }
+
+    def to_chrome_trace(self) -> Dict[str, Any]:
+        """Export as Chrome trace-event JSON, one complete ("X") event per span"""
+        with self._lock:
+            spans = list(self.spans.values())
+        events = [{
+            "name": "process_name", "ph": "M", "pid": 1,
+            "args": {"name": f"run {self.run_id}"},
+        }]
+        for span in spans:
+            end = span.end if span.end is not None else self._now()
+            events.append({
+                "name": span.name,
+                "cat": span.kind,
+                "ph": "X",
+                "ts": round(span.start * 1_000_000),
+                "dur": round((end - span.start) * 1_000_000),
+                "pid": 1,
+                "tid": span.thread_id,
+                "args": dict(span.attributes, status=span.status),
+            })
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+class TimelineStore:
+    """Bounded store of the most recent run timelines"""
+
+    def __init__(self, max_runs: int = 100):
+        self.max_runs = max_runs
+        self._timelines: "OrderedDict[str, RunTimeline]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, timeline: RunTimeline):
+        with self._lock:
+            self._timelines[timeline.run_id] = timeline
+            while len(self._timelines) > self.max_runs:
+                self._timelines.popitem(last=False)
+
+    def get(self, run_id: str) -> Optional[RunTimeline]:
+        with self._lock:
+            return self._timelines.get(run_id)
+
+
+timeline_store = TimelineStore(max_runs=int(os.environ.get("AGENT_TIMELINE_MAX_RUNS", "100")))
+
+
+# (file name, function) of Python frames parked in a blocking wait: the event loop's
+# selector, condition and event waits, queue reads, thread joins and idle pool workers
+IDLE_FRAMES = {
+    ("selectors.py", "select"),
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("queue.py", "get"),
+    ("thread.py", "_worker"),
+}
+
+
+class SamplingProfiler:
+    """Samples the Python stacks of the threads working on a run while it executes
+
+    `threads` returns the ids of the threads to sample, e.g.
+    `RunTimeline.active_threads`; without it every thread is sampled. Stacks
+    parked in a blocking wait (IDLE_FRAMES) are counted as idle and left out,
+    so the report shows work rather than waiting. Reports the frames most often
+    on top of a stack (self time) and the frames most often anywhere on a stack
+    (inclusive time). Sampling only sees Python frames, time spent in C
+    extensions is attributed to the calling frame.
+    """
+
+    _active = threading.Semaphore(1)
+
+    def __init__(self, interval: float = 0.005, top: int = 25, threads: Optional[Callable[[], set]] = None):
+        self.interval = interval
+        self.top = top
+        self.threads = threads
+        self.samples = 0
+        self.idle_samples = 0
+        self._self_counts: Counter = Counter()
+        self._inclusive_counts: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> bool:
+        """Start sampling, returns False if another run is already being profiled"""
+        if not self._active.acquire(blocking=False):
+            logger.warning("Another run is being profiled, skipping profiler")
+            return False
+        self._thread = threading.Thread(target=self._sample, name="run-profiler", daemon=True)
+        try:
+            self._thread.start()
+        except BaseException:
+            self._thread = None
+            self._active.release()
+            raise
+        return True
+
+    def stop(self) -> Dict[str, Any]:
+        """Stop sampling and return the report; called from the event loop, so it does not wait long"""
+        if self._thread is not None:
+            self._stop.set()
+            # The sampler only finishes its current pass, which takes well under the timeout
+            self._thread.join(timeout=0.5)
+            if self._thread.is_alive():
+                # The sampler still holds the semaphore, so no other run is profiled until it exits
+                logger.warning("Profiler thread did not stop in time, its last samples may be missing")
+            self._thread = None
+        return self.report()
+
+    def _sample(self):
+        try:
+            self._sample_until_stopped()
+        finally:
+            self._active.release()
+
+    def _sample_until_stopped(self):
+        own_thread = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            threads = self.threads() if self.threads is not None else None
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_thread or (threads is not None and thread_id not in threads):
+                    continue
+                if self._is_idle(frame):
+                    self.idle_samples += 1
+                    continue
+                self.samples += 1
+                self._self_counts[self._describe(frame)] += 1
+                seen = set()
+                while frame is not None:
+                    description = self._describe(frame)
+                    if description not in seen:
+                        seen.add(description)
+                        self._inclusive_counts[description] += 1
+                    frame = frame.f_back
+
+    @staticmethod
+    def _is_idle(frame) -> bool:
+        code = frame.f_code
+        return (os.path.basename(code.co_filename), code.co_name) in IDLE_FRAMES
+
+    @staticmethod
+    def _describe(frame) -> str:
+        code = frame.f_code
+        return f"{code.co_filename}:{code.co_firstlineno}({code.co_name})"
+
+    def report(self) -> Dict[str, Any]:
+        def rows(counts: Counter) -> List[Dict[str, Any]]:
+            return [
+                {"frame": frame, "samples": count, "share": round(count / self.samples, 4)}
+                for frame, count in counts.most_common(self.top)
+            ] if self.samples else []
+
+        return {
+            "interval": self.interval,
+            "samples": self.samples,
+            "idle_samples": self.idle_samples,
+            "self": rows(self._self_counts),
+            "inclusive": rows(self._inclusive_counts),
+        }
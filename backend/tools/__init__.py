@@ -2,5 +2,11 @@
 
 from .search_tools import scrape_webpages
 from .writing_tools import WritingTools
+from .search_cache import SearchCache, CachedSearchTool, FakeSearchBackend
+from .output_budget import ArtifactStore, ToolOutputBudget, ToolOutputLimit
 
-__all__ = ['scrape_webpages', 'WritingTools']
+__all__ = [
+    'scrape_webpages', 'WritingTools',
+    'SearchCache', 'CachedSearchTool', 'FakeSearchBackend',
+    'ArtifactStore', 'ToolOutputBudget', 'ToolOutputLimit',
+]
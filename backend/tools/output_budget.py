@@ -0,0 +1,176 @@
+# coding: utf-8
+
+import re
+import uuid
+import logging
+import threading
+from pathlib import Path
+from typing import Annotated, Dict, Optional, Tuple
+
+from langchain_core.tools import BaseTool, StructuredTool, tool
+
+logger = logging.getLogger(__name__)
+
+# Rough token estimate used for the caps, avoids loading a tokenizer per tool call
+CHARS_PER_TOKEN = 4
+
+
+class ToolOutputLimit:
+    """Byte and token caps for the output of one tool"""
+
+    def __init__(self, max_bytes: int, max_tokens: int):
+        self.max_bytes = max_bytes
+        self.max_tokens = max_tokens
+
+    @property
+    def max_chars(self) -> int:
+        return min(self.max_bytes, self.max_tokens * CHARS_PER_TOKEN)
+
+
+DEFAULT_LIMITS = {
+    "scrape_webpages": ToolOutputLimit(max_bytes=24_000, max_tokens=6_000),
+    "read_document": ToolOutputLimit(max_bytes=16_000, max_tokens=4_000),
+    "python_repl_tool": ToolOutputLimit(max_bytes=8_000, max_tokens=2_000),
+}
+DEFAULT_LIMIT = ToolOutputLimit(max_bytes=16_000, max_tokens=4_000)
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN
+
+
+class ArtifactStore:
+    """Stores oversized tool outputs of a session as files, addressed by handle"""
+
+    def __init__(self, directory: Path, page_chars: int = 8_000):
+        self.directory = Path(directory)
+        self.page_chars = page_chars
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, handle: str) -> Path:
+        if not re.fullmatch(r"art-[0-9a-f]{12}", handle):
+            raise ValueError(f"Invalid artifact handle: {handle}")
+        return self.directory / f"{handle}.txt"
+
+    def save(self, content: str) -> str:
+        handle = f"art-{uuid.uuid4().hex[:12]}"
+        self._path(handle).write_text(content, encoding="utf-8")
+        return handle
+
+    def page_count(self, content: str) -> int:
+        return max(1, -(-len(content) // self.page_chars))
+
+    def read_page(self, handle: str, page: int) -> Tuple[str, int]:
+        """Return the text of a 1-indexed page and the total number of pages"""
+        content = self._path(handle).read_text(encoding="utf-8")
+        total = self.page_count(content)
+        if not 1 <= page <= total:
+            raise ValueError(f"Page {page} is out of range, artifact {handle} has {total} pages")
+        start = (page - 1) * self.page_chars
+        return content[start:start + self.page_chars], total
+
+
+def summarize_incrementally(text: str, chunk_chars: int, max_lines: int = 20, line_chars: int = 160) -> str:
+    """Build an extractive outline of `text` one chunk at a time
+
+    Each chunk contributes its document titles, or else its first non-empty
+    line, so the summary is computed in one pass without holding more than a
+    chunk and the outline in memory.
+    """
+    outline = []
+    for index, start in enumerate(range(0, len(text), chunk_chars)):
+        chunk = text[start:start + chunk_chars]
+        titles = re.findall(r'<Document name="([^"]*)">', chunk)
+        if titles:
+            entry = "; ".join(title or "(untitled)" for title in titles)
+        else:
+            entry = next((line.strip() for line in chunk.splitlines() if line.strip()), "")
+        if entry:
+            outline.append(f"- page {index + 1}: {entry[:line_chars]}")
+        if len(outline) >= max_lines:
+            outline.append("- ...")
+            break
+    return "\n".join(outline)
+
+
+class ToolOutputBudget:
+    """Applies per-tool output caps before tool results reach an agent's history
+
+    Output within its tool's limit is returned unchanged. Larger output is saved
+    in the ArtifactStore and the agent gets a preview, an outline of the rest and
+    a handle it can page through with the `read_artifact` tool.
+    """
+
+    def __init__(
+        self,
+        store: ArtifactStore,
+        limits: Optional[Dict[str, ToolOutputLimit]] = None,
+        paging_tool: Optional[BaseTool] = None,
+    ):
+        self.store = store
+        self.limits = dict(DEFAULT_LIMITS if limits is None else limits)
+        # A replacement for read_artifact, e.g. when replaying recorded runs
+        self._paging_tool = paging_tool
+        self._lock = threading.Lock()
+
+    def limit_for(self, tool_name: str) -> ToolOutputLimit:
+        return self.limits.get(tool_name, DEFAULT_LIMIT)
+
+    def apply(self, tool_name: str, output) -> str:
+        text = output if isinstance(output, str) else str(output)
+        limit = self.limit_for(tool_name)
+        size = len(text.encode("utf-8"))
+        tokens = estimate_tokens(text)
+        if size <= limit.max_bytes and tokens <= limit.max_tokens:
+            return text
+
+        handle = self.store.save(text)
+        pages = self.store.page_count(text)
+        logger.info(f"{tool_name} output of {size} bytes stored as artifact {handle} ({pages} pages)")
+        # Half of the allowance goes to the preview, the rest to the outline and instructions
+        preview = text[:limit.max_chars // 2]
+        summary = summarize_incrementally(text, self.store.page_chars)
+        return (
+            f"[Output truncated: {size} bytes (~{tokens} tokens) exceeds the limit of {tool_name}]\n"
+            f"Full output stored as artifact {handle} with {pages} pages of {self.store.page_chars} characters. "
+            f"Call read_artifact with this handle and a page number to read more.\n\n"
+            f"Outline:\n{summary}\n\n"
+            f"Preview:\n{preview}"
+        )
+
+    def wrap(self, inner: BaseTool) -> BaseTool:
+        """Return a tool with the same name and arguments whose output is budgeted"""
+
+        def run(**kwargs):
+            # The inner tool runs without callbacks so each call is reported once
+            return self.apply(inner.name, inner.invoke(kwargs, config={"callbacks": []}))
+
+        return StructuredTool.from_function(
+            func=run,
+            name=inner.name,
+            description=inner.description,
+            args_schema=inner.args_schema,
+        )
+
+    def get_paging_tool(self) -> BaseTool:
+        with self._lock:
+            if self._paging_tool is None:
+                self._paging_tool = self._build_read_artifact_tool()
+            return self._paging_tool
+
+    def _build_read_artifact_tool(self):
+        store = self.store
+
+        @tool
+        def read_artifact(
+            handle: Annotated[str, "Artifact handle from a truncated tool output, e.g. art-0123456789ab."],
+            page: Annotated[int, "1-indexed page number to read."] = 1,
+        ) -> str:
+            """Read one page of a tool output that was too large to return in full."""
+            try:
+                text, total = store.read_page(handle, page)
+            except (ValueError, FileNotFoundError) as e:
+                return f"Error: {str(e)}"
+            return f"[Artifact {handle}, page {page} of {total}]\n{text}"
+
+        return read_artifact
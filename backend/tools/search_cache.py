@@ -0,0 +1,350 @@
+# coding: utf-8
+
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional, Type
+
+from pydantic import BaseModel, ConfigDict, Field
+from langchain_core.callbacks import CallbackManagerForToolRun
+from langchain_core.tools import BaseTool
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = Path(tempfile.gettempdir()) / "agent_search_cache"
+DEFAULT_TTL_SECONDS = 24 * 3600
+DEFAULT_MAX_DISK_ENTRIES = 10000
+# Writes between two sweeps of the cache directory
+SWEEP_INTERVAL = 100
+
+# Tavily reports failures as the repr of the exception instead of raising
+_ERROR_RESULT_PATTERN = re.compile(r"^\w*(Error|Exception)\(")
+
+
+def normalize_query(query: str) -> str:
+    """Normalize a query so trivially different phrasings share a cache entry"""
+    query = query.strip().lower()
+    query = re.sub(r"\s+", " ", query)
+    return query.strip(" \"'`?!.,;:")
+
+
+def _env_number(var: str, default, cast):
+    value = os.environ.get(var)
+    if value is None or value.strip() == "":
+        return default
+    try:
+        return cast(value)
+    except ValueError:
+        logger.warning(f"Ignoring invalid value for {var}: {value}, using {default}")
+        return default
+
+
+def _is_cacheable(result: Any) -> bool:
+    if result is None:
+        return False
+    if isinstance(result, str) and _ERROR_RESULT_PATTERN.match(result):
+        return False
+    return True
+
+
+class SearchCache:
+    """Search result cache with TTL, on-disk backing store and in-flight coalescing
+
+    Entries live in a bounded in-memory LRU and, when `cache_dir` is set, as one
+    JSON file per query so they survive restarts and are shared across sessions.
+    The directory is swept of expired entries on startup and every
+    SWEEP_INTERVAL writes, or sooner once it holds more than `max_disk_entries`
+    files, in which case the oldest entries are removed as well.
+    Concurrent lookups of the same query wait for a single upstream call.
+    """
+
+    def __init__(
+        self,
+        cache_dir: Optional[Path] = DEFAULT_CACHE_DIR,
+        ttl_seconds: float = DEFAULT_TTL_SECONDS,
+        max_memory_entries: int = 1024,
+        max_disk_entries: int = DEFAULT_MAX_DISK_ENTRIES,
+    ):
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+        self.ttl_seconds = ttl_seconds
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+        self._disk_entries = 0
+        self._writes_since_sweep = 0
+        self._sweep_lock = threading.Lock()
+        self._memory: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._in_flight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        if self.cache_dir is not None:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            self.sweep()
+
+    @classmethod
+    def from_env(cls) -> "SearchCache":
+        """Configure via AGENT_SEARCH_CACHE_DIR (empty for memory only), AGENT_SEARCH_CACHE_TTL
+        and AGENT_SEARCH_CACHE_MAX_ENTRIES"""
+        cache_dir = os.environ.get("AGENT_SEARCH_CACHE_DIR", str(DEFAULT_CACHE_DIR))
+        return cls(
+            cache_dir=Path(cache_dir) if cache_dir else None,
+            ttl_seconds=_env_number("AGENT_SEARCH_CACHE_TTL", DEFAULT_TTL_SECONDS, float),
+            max_disk_entries=_env_number("AGENT_SEARCH_CACHE_MAX_ENTRIES", DEFAULT_MAX_DISK_ENTRIES, int),
+        )
+
+    @staticmethod
+    def make_key(query: str, namespace: str = "") -> str:
+        return hashlib.sha256(f"{namespace}\n{normalize_query(query)}".encode("utf-8")).hexdigest()
+
+    def _is_fresh(self, entry: Dict[str, Any]) -> bool:
+        return time.time() - entry["created_at"] < self.ttl_seconds
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.json"
+
+    def _memory_get(self, key: str) -> Optional[Dict[str, Any]]:
+        # Callers hold self._lock
+        entry = self._memory.get(key)
+        if entry is not None:
+            if self._is_fresh(entry):
+                self._memory.move_to_end(key)
+                return entry
+            del self._memory[key]
+        return None
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return a fresh cache entry, looking at memory first and then disk"""
+        with self._lock:
+            entry = self._memory_get(key)
+        if entry is not None:
+            return entry
+        return self._disk_get(key)
+
+    def _disk_get(self, key: str) -> Optional[Dict[str, Any]]:
+        if self.cache_dir is None:
+            return None
+        path = self._path(key)
+        try:
+            with path.open("r", encoding="utf-8") as file:
+                entry = json.load(file)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable search cache entry {path}: {str(e)}")
+            return None
+        if not self._is_fresh(entry):
+            path.unlink(missing_ok=True)
+            with self._lock:
+                self._disk_entries = max(0, self._disk_entries - 1)
+            return None
+        self._remember(key, entry)
+        return entry
+
+    def set(self, key: str, query: str, result: Any):
+        entry = {"query": query, "created_at": time.time(), "result": result}
+        self._remember(key, entry)
+        if self.cache_dir is None:
+            return
+        # Write to a temporary file first so readers never see a partial entry
+        path = self._path(key)
+        tmp_path = path.with_suffix(f".{threading.get_ident()}.tmp")
+        is_new = not path.exists()
+        try:
+            with tmp_path.open("w", encoding="utf-8") as file:
+                json.dump(entry, file, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except (OSError, TypeError, ValueError) as e:
+            logger.warning(f"Failed to persist search cache entry: {str(e)}")
+            tmp_path.unlink(missing_ok=True)
+            return
+        with self._lock:
+            self._disk_entries += is_new
+            self._writes_since_sweep += 1
+            due = self._writes_since_sweep >= SWEEP_INTERVAL or self._disk_entries > self.max_disk_entries
+        if due:
+            self.sweep()
+
+    def sweep(self) -> int:
+        """Delete expired entries and leftover temporary files, then the oldest entries above
+        `max_disk_entries`; returns the number of entries deleted"""
+        if self.cache_dir is None or not self._sweep_lock.acquire(blocking=False):
+            return 0
+        try:
+            now = time.time()
+            entries, removed = [], 0
+            for path in self.cache_dir.iterdir():
+                try:
+                    # Entries are written once, so the modification time is their creation time
+                    modified = path.stat().st_mtime
+                    if path.suffix == ".tmp":
+                        # A write in progress takes milliseconds, older ones were interrupted
+                        if now - modified > 60:
+                            path.unlink(missing_ok=True)
+                    elif path.suffix == ".json":
+                        if now - modified >= self.ttl_seconds:
+                            path.unlink(missing_ok=True)
+                            removed += 1
+                        else:
+                            entries.append((modified, path))
+                except OSError:
+                    continue
+            entries.sort()
+            excess = max(0, len(entries) - self.max_disk_entries)
+            for _, path in entries[:excess]:
+                path.unlink(missing_ok=True)
+            removed += excess
+            entries = entries[excess:]
+            with self._lock:
+                self._disk_entries = len(entries)
+                self._writes_since_sweep = 0
+            if removed:
+                logger.info(f"Search cache sweep removed {removed} entries, {len(entries)} left")
+            return removed
+        finally:
+            self._sweep_lock.release()
+
+    def _remember(self, key: str, entry: Dict[str, Any]):
+        with self._lock:
+            self._memory[key] = entry
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_memory_entries:
+                self._memory.popitem(last=False)
+
+    def get_or_fetch(self, query: str, fetch: Callable[[], Any], namespace: str = "") -> Any:
+        """Return the cached result for `query`, calling `fetch` at most once per key concurrently"""
+        key = self.make_key(query, namespace)
+        # The memory lookup and the in-flight registration share one lock acquisition, so a
+        # fetch that finished in between is seen in memory rather than started again
+        with self._lock:
+            entry = self._memory_get(key)
+            future = None if entry is not None else self._in_flight.get(key)
+            owner = entry is None and future is None
+            if entry is not None:
+                self.hits += 1
+            elif owner:
+                future = Future()
+                self._in_flight[key] = future
+            else:
+                self.coalesced += 1
+
+        if entry is not None:
+            logger.info(f"Search cache hit: {query}")
+            return entry["result"]
+        if not owner:
+            logger.info(f"Waiting for in-flight search: {query}")
+            return future.result()
+
+        try:
+            # Disk reads happen outside the lock, concurrent callers wait on the future meanwhile
+            entry = self._disk_get(key)
+            if entry is not None:
+                with self._lock:
+                    self.hits += 1
+                logger.info(f"Search cache hit: {query}")
+                result = entry["result"]
+                future.set_result(result)
+                return result
+            with self._lock:
+                self.misses += 1
+            result = fetch()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            if _is_cacheable(result):
+                self.set(key, query, result)
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "memory_entries": len(self._memory),
+                "disk_entries": self._disk_entries,
+            }
+
+
+class SearchInput(BaseModel):
+    """Input for search tools."""
+
+    query: str = Field(description="search query to look up")
+
+
+class CachedSearchTool(BaseTool):
+    """Search tool answering from a SearchCache before calling the wrapped backend tool
+
+    It keeps the backend's name, description and arguments, so agents see the
+    same tool whether or not caching is enabled.
+    """
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    backend: BaseTool
+    cache: SearchCache
+
+    def __init__(self, backend: BaseTool, cache: SearchCache, **kwargs: Any):
+        super().__init__(
+            name=backend.name,
+            description=backend.description,
+            args_schema=backend.args_schema or SearchInput,
+            backend=backend,
+            cache=cache,
+            **kwargs,
+        )
+
+    def _run(self, query: str, run_manager: Optional[CallbackManagerForToolRun] = None) -> Any:
+        # Results depend on the backend configuration as well as on the query
+        namespace = f"{self.backend.name}:{getattr(self.backend, 'max_results', '')}"
+        # The backend runs without callbacks so each search is reported once, as this tool
+        return self.cache.get_or_fetch(
+            query,
+            lambda: self.backend.invoke({"query": query}, config={"callbacks": []}),
+            namespace=namespace,
+        )
+
+
+class FakeSearchBackend(BaseTool):
+    """Local stand-in for TavilySearchResults, for offline runs and cache tests
+
+    Returns canned results for known (normalized) queries and a generated
+    result otherwise, optionally after `delay` seconds. `calls` counts the
+    upstream calls actually made.
+    """
+
+    name: str = "tavily_search_results_json"
+    description: str = (
+        "A search engine optimized for comprehensive, accurate, and trusted results. "
+        "Useful for when you need to answer questions about current events. "
+        "Input should be a search query."
+    )
+    args_schema: Type[BaseModel] = SearchInput
+    results: Dict[str, list] = Field(default_factory=dict)
+    delay: float = 0.0
+    calls: int = 0
+
+    def _run(self, query: str, run_manager: Optional[CallbackManagerForToolRun] = None) -> list:
+        self.calls += 1
+        if self.delay:
+            time.sleep(self.delay)
+        normalized = normalize_query(query)
+        if normalized in self.results:
+            return self.results[normalized]
+        return [{
+            "url": f"https://example.com/search?q={normalized.replace(' ', '+')}",
+            "content": f"Fake search result for: {query}",
+        }]
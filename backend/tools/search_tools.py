@@ -2,12 +2,14 @@
 
 from typing import List
 
-from langchain_community.document_loaders import WebBaseLoader
 from langchain_core.tools import tool
 
 @tool
 def scrape_webpages(urls: List[str]) -> str:
     """Use requests and bs4 to scrape the provided web pages for detailed information."""
+    # Imported on first use, langchain_community is slow to import
+    from langchain_community.document_loaders import WebBaseLoader
+
     loader = WebBaseLoader(urls)
     docs = loader.load()
     return "\n\n".join(
@@ -3,13 +3,18 @@
 from pathlib import Path
 from typing import List, Dict, Optional, Annotated, Literal, Union
 
-from langchain_experimental.utilities import PythonREPL
 from langchain_core.tools import tool
 
+from .output_budget import ToolOutputBudget
+
 
 class WritingTools:
-    def __init__(self, working_directory: Path):
+    # Tools whose output can grow without bound and is therefore budgeted
+    BUDGETED_TOOL_TYPES = ("reading", "repl")
+
+    def __init__(self, working_directory: Path, output_budget: Optional[ToolOutputBudget] = None):
         self.working_directory = working_directory
+        self.output_budget = output_budget
         # Tool cache
         self._tools_cache = {}
 
@@ -92,6 +97,9 @@ class WritingTools:
         return edit_document
 
     def _build_python_repl_tool(self):
+        # Imported only when an agent actually needs the REPL tool
+        from langchain_experimental.utilities import PythonREPL
+
         repl = PythonREPL()
 
         @tool
@@ -128,9 +136,16 @@ class WritingTools:
             if tool_type in self._tool_builders:
                 # 按需构建工具：如果缓存中没有，则构建并缓存
                 if tool_type not in self._tools_cache:
-                    self._tools_cache[tool_type] = self._tool_builders[tool_type]()
+                    built_tool = self._tool_builders[tool_type]()
+                    if self.output_budget is not None and tool_type in self.BUDGETED_TOOL_TYPES:
+                        built_tool = self.output_budget.wrap(built_tool)
+                    self._tools_cache[tool_type] = built_tool
                 tools.append(self._tools_cache[tool_type])
             else:
                 raise ValueError(f"Unknown tool type: {tool_type}")
 
+        # Agents with budgeted tools need a way to page through truncated output
+        if self.output_budget is not None and any(t in self.BUDGETED_TOOL_TYPES for t in tool_types):
+            tools.append(self.output_budget.get_paging_tool())
+
         return tools
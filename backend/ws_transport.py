@@ -0,0 +1,271 @@
+# coding: utf-8
+"""Multiplexed WebSocket transport
+
+One connection carries a session handshake, any number of concurrent runs,
+file list events and cancellation. Every message is a binary frame:
+
+    type (uint8) | flags (uint8) | channel (uint32) | seq (uint32) | payload
+
+All integers are big-endian. The payload is compact JSON, deflated with zlib
+when the FLAG_COMPRESSED bit is set. `channel` identifies a run and is chosen
+by the client, 0 is used for connection-level frames. Server frames of a run
+are numbered by `seq` starting at 1; the client acknowledges them with ACK
+frames and the server pauses a run once `window` frames are unacknowledged.
+END is always the last frame of a run's channel, after any ERROR and FILES.
+"""
+
+import json
+import math
+import zlib
+import struct
+import asyncio
+import logging
+from contextlib import aclosing
+from typing import Any, Callable, Dict, Optional
+
+from fastapi import WebSocket, WebSocketDisconnect
+
+logger = logging.getLogger(__name__)
+
+# Frame types, client -> server
+HELLO = 1     # {"session_id": optional str, "window": optional int}
+RUN = 2       # {"query": str, "recursion_limit": int, "max_seconds": ..., "profile": bool, ...}
+CANCEL = 3    # {}
+ACK = 4       # {}, seq is the last frame of the channel processed by the client
+LIST_FILES = 5  # {}
+# Frame types, server -> client
+SESSION = 16  # {"session_id": str}
+MESSAGE = 17  # {"response": str, "metadata": dict}
+BUDGET_EXHAUSTED = 18  # {"reason": str, "budget": dict, "usage": dict}
+END = 19      # {"detail": str}
+ERROR = 20    # {"detail": str}
+FILES = 21    # {"files": [str]}
+RUN_STARTED = 22  # {"run_id": str, "session_id": str}, run_id addresses /runs/{run_id}/timeline
+
+FLAG_COMPRESSED = 0x01
+
+HEADER = struct.Struct("!BBII")
+COMPRESS_THRESHOLD = 512
+DEFAULT_WINDOW = 64
+
+# Numeric RUN fields and their types, validated before a channel is opened
+RUN_LIMIT_TYPES = {"max_seconds": float, "max_tokens": int, "max_tool_calls": int, "max_cost": float}
+
+# run_events() event types mapped to frame types
+EVENT_FRAME_TYPES = {
+    "run": RUN_STARTED,
+    "message": MESSAGE,
+    "budget_exhausted": BUDGET_EXHAUSTED,
+    "end": END,
+    "error": ERROR,
+}
+
+
+class ProtocolError(Exception):
+    pass
+
+
+def encode_frame(frame_type: int, payload: Any = None, channel: int = 0, seq: int = 0) -> bytes:
+    body = json.dumps(payload if payload is not None else {}, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+    flags = 0
+    if len(body) > COMPRESS_THRESHOLD:
+        compressed = zlib.compress(body, 6)
+        if len(compressed) < len(body):
+            body = compressed
+            flags |= FLAG_COMPRESSED
+    return HEADER.pack(frame_type, flags, channel, seq) + body
+
+
+def decode_frame(data: bytes) -> tuple:
+    """Return (frame type, channel, seq, payload) of a binary frame"""
+    if len(data) < HEADER.size:
+        raise ProtocolError("Frame shorter than header")
+    frame_type, flags, channel, seq = HEADER.unpack_from(data)
+    body = data[HEADER.size:]
+    try:
+        if flags & FLAG_COMPRESSED:
+            body = zlib.decompress(body)
+        payload = json.loads(body) if body else {}
+    except (zlib.error, ValueError) as e:
+        raise ProtocolError(f"Invalid payload: {str(e)}")
+    return frame_type, channel, seq, payload
+
+
+def _number(payload: dict, name: str, kind: type, default: Any = None) -> Any:
+    """A numeric payload field converted to `kind`, ProtocolError unless it is a finite number >= 0"""
+    value = payload.get(name)
+    if value is None:
+        return default
+    if isinstance(value, bool):
+        raise ProtocolError(f"{name} must be a number")
+    try:
+        number = kind(value)
+    except (TypeError, ValueError, OverflowError):
+        raise ProtocolError(f"{name} must be a number, got {value!r}")
+    if not math.isfinite(number) or number < 0:
+        raise ProtocolError(f"{name} must be a non-negative number, got {value!r}")
+    return number
+
+
+class RunChannel:
+    """State of one run on a connection, including its flow-control window"""
+
+    def __init__(self, channel: int, window: int):
+        self.channel = channel
+        self.window = window
+        self.acked = 0
+        self.task: Optional[asyncio.Task] = None
+        self._acked_event = asyncio.Event()
+
+    def ack(self, seq: int):
+        if seq > self.acked:
+            self.acked = seq
+            self._acked_event.set()
+
+    async def wait_for_window(self, seq: int):
+        # window <= 0 disables flow control
+        while self.window > 0 and seq - self.acked > self.window:
+            self._acked_event.clear()
+            await self._acked_event.wait()
+
+
+class MultiplexedConnection:
+    """Serves one WebSocket, see the module docstring for the protocol
+
+    `run_events(query, session, recursion_limit, limits, profile)` is the same async
+    event generator that backs the SSE endpoints.
+    """
+
+    def __init__(self, websocket: WebSocket, session_manager, run_events: Callable, window: int = DEFAULT_WINDOW):
+        self.websocket = websocket
+        self.session_manager = session_manager
+        self.run_events = run_events
+        self.window = window
+        self.session = None
+        self.runs: Dict[int, RunChannel] = {}
+        self._send_lock = asyncio.Lock()
+
+    async def send(self, frame_type: int, payload: Any = None, channel: int = 0, seq: int = 0):
+        data = encode_frame(frame_type, payload, channel, seq)
+        async with self._send_lock:
+            await self.websocket.send_bytes(data)
+
+    async def serve(self):
+        await self.websocket.accept()
+        try:
+            while True:
+                message = await self.websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    break
+                data = message.get("bytes")
+                if data is None:
+                    await self.send(ERROR, {"detail": "Only binary frames are supported"})
+                    continue
+                channel = 0
+                try:
+                    frame_type, channel, seq, payload = decode_frame(data)
+                    await self.handle(frame_type, channel, seq, payload)
+                except ProtocolError as e:
+                    await self.send(ERROR, {"detail": str(e)}, channel)
+        except WebSocketDisconnect:
+            pass
+        finally:
+            for run in list(self.runs.values()):
+                if run.task is not None:
+                    run.task.cancel()
+            logger.info(f"WebSocket connection closed, cancelled {len(self.runs)} running runs")
+
+    def _ensure_session(self, session_id: Optional[str] = None):
+        if session_id is not None and not isinstance(session_id, str):
+            raise ProtocolError("session_id must be a string")
+        try:
+            if session_id:
+                session = self.session_manager.get_session(session_id)
+                if session:
+                    self.session = session
+                    return session
+            if self.session is None:
+                self.session = self.session_manager.create_session()
+        except Exception as e:
+            logger.error(f"Error opening session for WebSocket: {str(e)}", exc_info=True)
+            raise ProtocolError(f"Could not open session: {str(e)}")
+        return self.session
+
+    async def handle(self, frame_type: int, channel: int, seq: int, payload: Any):
+        if not isinstance(payload, dict):
+            raise ProtocolError("Frame payload must be a JSON object")
+        if frame_type == HELLO:
+            self.window = _number(payload, "window", int, self.window)
+            session = self._ensure_session(payload.get("session_id"))
+            await self.send(SESSION, {"session_id": session.id})
+        elif frame_type == RUN:
+            await self.start_run(channel, payload)
+        elif frame_type == CANCEL:
+            run = self.runs.get(channel)
+            if run is not None and run.task is not None:
+                run.task.cancel()
+        elif frame_type == ACK:
+            run = self.runs.get(channel)
+            if run is not None:
+                run.ack(seq)
+        elif frame_type == LIST_FILES:
+            session = self._ensure_session()
+            session.update_last_used()
+            await self.send(FILES, {"files": session.list_files()}, channel)
+        else:
+            raise ProtocolError(f"Unknown frame type: {frame_type}")
+
+    async def start_run(self, channel: int, payload: dict):
+        if channel == 0 or channel in self.runs:
+            raise ProtocolError(f"Channel {channel} is reserved or already in use")
+        query = payload.get("query")
+        if not query or not isinstance(query, str):
+            raise ProtocolError("RUN frame requires a query")
+        # Validate everything before the channel is registered, a rejected frame leaves it free
+        recursion_limit = _number(payload, "recursion_limit", int, 150)
+        limits = {name: _number(payload, name, kind) for name, kind in RUN_LIMIT_TYPES.items()}
+        session = self._ensure_session(payload.get("session_id"))
+
+        run = RunChannel(channel, self.window)
+        self.runs[channel] = run
+        await self.send(SESSION, {"session_id": session.id}, channel)
+        run.task = asyncio.create_task(
+            self._run(run, session, query, recursion_limit, limits, bool(payload.get("profile", False)))
+        )
+
+    async def _run(self, run: RunChannel, session, query: str, recursion_limit: int, limits: dict,
+                   profile: bool = False):
+        seq = 0
+        end = {"detail": "Processing completed"}
+        try:
+            events = self.run_events(query, session, recursion_limit, limits, profile)
+            async with aclosing(events):
+                async for event_type, data in events:
+                    if isinstance(data, str):
+                        data = {"detail": data}
+                    if event_type == "end":
+                        # Held back so END closes the channel after the file list
+                        end = data
+                        continue
+                    seq += 1
+                    await run.wait_for_window(seq)
+                    await self.send(EVENT_FRAME_TYPES[event_type], data, run.channel, seq)
+            # Runs usually create or change documents, push the new file list
+            await self.send(FILES, {"files": session.list_files()}, run.channel, seq + 1)
+            await self.send(END, end, run.channel, seq + 2)
+        except asyncio.CancelledError:
+            logger.info(f"Run on channel {run.channel} cancelled")
+            try:
+                await self.send(END, {"detail": "Processing cancelled"}, run.channel, seq + 1)
+            except Exception:
+                pass
+        except Exception as e:
+            logger.error(f"Error in WebSocket run on channel {run.channel}: {str(e)}", exc_info=True)
+            # End the channel like the SSE stream does, the client would otherwise wait forever
+            try:
+                await self.send(ERROR, {"detail": str(e)}, run.channel, seq + 1)
+                await self.send(END, {"detail": f"Processing error: {str(e)}"}, run.channel, seq + 2)
+            except Exception:
+                pass
+        finally:
+            self.runs.pop(run.channel, None)
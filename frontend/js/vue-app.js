@@ -1,4 +1,4 @@
-const { createApp, ref, computed, nextTick, watch } = Vue;
+const { createApp, ref, computed, nextTick, onMounted, onBeforeUnmount } = Vue;
 
 document.addEventListener('DOMContentLoaded', () => {
     createApp({
@@ -30,6 +30,147 @@ document.addEventListener('DOMContentLoaded', () => {
             const userQueryTime = ref('');
             const chatMessages = ref([]);
             
+            // Virtualized message list: only messages near the viewport are rendered,
+            // the others are replaced by spacers of their measured (or estimated) height
+            const ESTIMATED_MESSAGE_HEIGHT = 120;
+            const OVERSCAN_MESSAGES = 4;
+            const messageList = ref(null);
+            const scrollTop = ref(0);
+            const viewportHeight = ref(800);
+            const heightsVersion = ref(0);
+            let messageHeights = [];
+            
+            function messageHeight(index) {
+                return messageHeights[index] || ESTIMATED_MESSAGE_HEIGHT;
+            }
+            
+            const visibleRange = computed(() => {
+                heightsVersion.value;
+                const count = chatMessages.value.length;
+                const listTop = messageList.value ? messageList.value.offsetTop : 0;
+                const viewTop = Math.max(0, scrollTop.value - listTop);
+                const viewBottom = viewTop + viewportHeight.value;
+                let start = 0;
+                let offset = 0;
+                while (start < count && offset + messageHeight(start) < viewTop) {
+                    offset += messageHeight(start);
+                    start++;
+                }
+                let end = start;
+                let bottom = offset;
+                while (end < count && bottom < viewBottom) {
+                    bottom += messageHeight(end);
+                    end++;
+                }
+                start = Math.max(0, start - OVERSCAN_MESSAGES);
+                end = Math.min(count, end + OVERSCAN_MESSAGES);
+                let paddingTop = 0;
+                for (let i = 0; i < start; i++) paddingTop += messageHeight(i);
+                let paddingBottom = 0;
+                for (let i = end; i < count; i++) paddingBottom += messageHeight(i);
+                return { start, end, paddingTop, paddingBottom };
+            });
+            
+            const visibleMessages = computed(() => {
+                const { start, end } = visibleRange.value;
+                return chatMessages.value.slice(start, end).map((item, offset) => ({ item, index: start + offset }));
+            });
+            
+            // Record the rendered heights, re-rendering only when one actually changed
+            function measureMessages() {
+                if (!messageList.value) return;
+                let changed = false;
+                messageList.value.querySelectorAll('[data-index]').forEach((element) => {
+                    const index = Number(element.dataset.index);
+                    const height = element.offsetHeight + parseFloat(getComputedStyle(element).marginBottom);
+                    if (messageHeights[index] !== height) {
+                        messageHeights[index] = height;
+                        changed = true;
+                    }
+                });
+                if (changed) heightsVersion.value++;
+            }
+            
+            function onChatScroll() {
+                if (!processContent.value) return;
+                scrollTop.value = processContent.value.scrollTop;
+                viewportHeight.value = processContent.value.clientHeight;
+                nextTick(measureMessages);
+            }
+            
+            function isScrolledToBottom() {
+                const element = processContent.value;
+                return !element || element.scrollHeight - element.scrollTop - element.clientHeight < 40;
+            }
+            
+            function scrollToBottom() {
+                if (processContent.value) {
+                    processContent.value.scrollTop = processContent.value.scrollHeight;
+                    onChatScroll();
+                }
+            }
+            
+            function resetMessages() {
+                pendingEvents = [];
+                messageHeights = [];
+                heightsVersion.value++;
+                chatMessages.value = [];
+            }
+            
+            // Stream events are buffered and applied once per animation frame, so
+            // reactivity and DOM updates run per frame instead of per token
+            let pendingEvents = [];
+            let flushScheduled = false;
+            
+            function queueEvent(event) {
+                pendingEvents.push(event);
+                if (!flushScheduled) {
+                    flushScheduled = true;
+                    requestAnimationFrame(flushEvents);
+                }
+            }
+            
+            function flushEvents() {
+                flushScheduled = false;
+                if (pendingEvents.length === 0) return;
+                const events = pendingEvents;
+                pendingEvents = [];
+                const stickToBottom = isScrolledToBottom();
+                const messages = chatMessages.value;
+                const timestamp = getCurrentTime();
+                for (const event of events) {
+                    const last = messages.length > 0 ? messages[messages.length - 1] : null;
+                    if (event.sender_id !== undefined && last && last.sender_id === event.sender_id) {
+                        last.content += event.content;
+                        last.timestamp = timestamp;
+                    } else {
+                        messages.push({ ...event, 'timestamp': event.timestamp || timestamp });
+                    }
+                }
+                nextTick(() => {
+                    measureMessages();
+                    if (stickToBottom) scrollToBottom();
+                });
+            }
+            
+            function pushSystemMessage(content) {
+                queueEvent({
+                    'team': 'system',
+                    'sender': 'System',
+                    'content': content,
+                    'timestamp': getCurrentTime()
+                });
+            }
+            
+            onMounted(() => {
+                window.addEventListener('resize', onChatScroll);
+                onChatScroll();
+            });
+            
+            onBeforeUnmount(() => {
+                window.removeEventListener('resize', onChatScroll);
+            });
+            
             const hasResponse = computed(() => chatMessages.value.length > 0 || userQuery.value);
             const hasResult = computed(() => resultFiles.value.length > 0);
             const selectedFile = computed(() => {
@@ -73,15 +214,6 @@ document.addEventListener('DOMContentLoaded', () => {
                 URL.revokeObjectURL(url);
             }
             
-            // Auto scroll to bottom
-            watch(chatMessages, () => {
-                nextTick(() => {
-                    if (processContent.value) {
-                        processContent.value.scrollTop = processContent.value.scrollHeight;
-                    }
-                });
-            }, { deep: true });
-            
             // Session management related functions
             // Validate if session ID is valid
             async function validateSession() {
@@ -166,14 +298,9 @@ document.addEventListener('DOMContentLoaded', () => {
             function handleSessionError(errorType) {
                 isLoading.value = false;
                 statusMessage.value = STATUS_MESSAGES.SESSION_ERROR;
-                chatMessages.value.push({
-                    'team': 'system',
-                    'sender': 'System',
-                    'content': errorType === 'validation' 
-                        ? 'Error validating session ID. Please ensure the backend server is running and the address is configured correctly.'
-                        : 'Error creating new session. Please ensure the backend server is running and the address is configured correctly.',
-                    'timestamp': getCurrentTime()
-                });
+                pushSystemMessage(errorType === 'validation' 
+                    ? 'Error validating session ID. Please ensure the backend server is running and the address is configured correctly.'
+                    : 'Error creating new session. Please ensure the backend server is running and the address is configured correctly.');
                 return false;
             }
             
@@ -261,22 +388,12 @@ document.addEventListener('DOMContentLoaded', () => {
                     } else {
                         // Show initialization failed error
                         statusMessage.value = STATUS_MESSAGES.SESSION_INIT_ERROR;
-                        chatMessages.value.push({
-                            'team': 'system',
-                            'sender': 'System',
-                            'content': 'Failed to connect to backend API. Please ensure the backend server is running and the address is configured correctly.',
-                            'timestamp': getCurrentTime()
-                        });
+                        pushSystemMessage('Failed to connect to backend API. Please ensure the backend server is running and the address is configured correctly.');
                     }
                 } catch (error) {
                     console.error('Failed to initialize session:', error);
                     statusMessage.value = STATUS_MESSAGES.SESSION_INIT_ERROR;
-                    chatMessages.value.push({
-                        'team': 'system',
-                        'sender': 'System',
-                        'content': 'Failed to connect to backend API. Please ensure the backend server is running and the address is configured correctly.',
-                        'timestamp': getCurrentTime()
-                    });
+                    pushSystemMessage('Failed to connect to backend API. Please ensure the backend server is running and the address is configured correctly.');
                 }
             }
             
@@ -288,7 +405,7 @@ document.addEventListener('DOMContentLoaded', () => {
                 if (!query.value.trim()) return;
                 
                 // Clear previous chat messages
-                chatMessages.value = [];
+                resetMessages();
                 
                 // Record user query
                 userQuery.value = query.value;
@@ -362,36 +479,15 @@ document.addEventListener('DOMContentLoaded', () => {
                         //     'content': content,
                         //     'timestamp': getCurrentTime()
                         // });
-                        if (chatMessages.value.length > 0) {
-                            const lastIndex = chatMessages.value.length - 1;
-                            if (chatMessages.value[lastIndex].sender_id === sender_id) {
-                                chatMessages.value[lastIndex].content += response;
-                                chatMessages.value[lastIndex].timestamp = getCurrentTime();
-                            } else {
-                                chatMessages.value.push({
-                                    'team': teamName,
-                                    'sender': sender_name,
-                                    'sender_id': sender_id,
-                                    'content': response,
-                                    'timestamp': getCurrentTime()
-                                })
-                            }
-                        } else {
-                            chatMessages.value.push({
-                                'team': teamName,
-                                'sender': sender_name,
-                                'sender_id': sender_id,
-                                'content': response,
-                                'timestamp': getCurrentTime()
-                            })
-                        }
-                    } catch (error) {
-                        chatMessages.value.push({
-                            'team': 'system',
-                            'sender': 'System',
-                            'content': error.message,
-                            'timestamp': getCurrentTime()
+                        // Tokens of the same sender are appended to its last message when flushed
+                        queueEvent({
+                            'team': teamName,
+                            'sender': sender_name,
+                            'sender_id': sender_id,
+                            'content': response
                         });
+                    } catch (error) {
+                        pushSystemMessage(error.message);
                     }
 
                 };
@@ -399,23 +495,31 @@ document.addEventListener('DOMContentLoaded', () => {
                 eventSource.onerror = (error) => {
                     console.error('EventSource error:', error);
                     eventSource.close();
+                    flushEvents();
                     isLoading.value = false;
                     statusMessage.value = STATUS_MESSAGES.ERROR;
                     
                     // If connection error, show notification
                     if (chatMessages.value.length === 0) {
-                        chatMessages.value.push({
-                            'team': 'system',
-                            'sender': 'System',
-                            'content': 'Failed to connect to backend API. Please ensure the backend server is running and the address is configured correctly.',
-                            'timestamp': getCurrentTime()
-                        });
+                        pushSystemMessage('Failed to connect to backend API. Please ensure the backend server is running and the address is configured correctly.');
                     }
                 };
                 
+                // Run budget exhausted: the messages received so far are the partial result
+                eventSource.addEventListener('budget_exhausted', (event) => {
+                    let reason = 'budget';
+                    try {
+                        reason = JSON.parse(event.data).reason || reason;
+                    } catch (e) {
+                        console.error('Failed to parse budget event:', e);
+                    }
+                    pushSystemMessage(`[System] Run budget exhausted (${reason}), showing partial result.`);
+                });
+                
                 // When stream ends
                 eventSource.addEventListener('end', () => {
                     eventSource.close();
+                    flushEvents();
                     isLoading.value = false;
                     statusMessage.value = STATUS_MESSAGES.COMPLETED;
                     // Refresh workspace file list after completion
@@ -428,19 +532,14 @@ document.addEventListener('DOMContentLoaded', () => {
                         eventSource.close();
                         isLoading.value = false;
                         statusMessage.value = STATUS_MESSAGES.TIMEOUT;
-                        chatMessages.value.push({
-                            'team': 'system',
-                            'sender': 'System',
-                            'content': '\n\n[System] Response timeout, connection closed.',
-                            'timestamp': getCurrentTime()
-                        });
+                        pushSystemMessage('\n\n[System] Response timeout, connection closed.');
                     }
                 }, 5 * 60 * 1000);
             }
             
             // Clear response
             function clearResponse() {
-                chatMessages.value = [];
+                resetMessages();
                 userQuery.value = '';
                 resultFiles.value = [];
                 selectedFileIndex.value = null;
@@ -465,6 +564,10 @@ document.addEventListener('DOMContentLoaded', () => {
                 userQuery,
                 userQueryTime,
                 chatMessages,
+                messageList,
+                visibleRange,
+                visibleMessages,
+                onChatScroll,
                 submitQuery,
                 clearResponse,
                 selectFile,
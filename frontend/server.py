@@ -2,25 +2,155 @@
 # coding: utf-8
 
 import os
-from fastapi import FastAPI, HTTPException
+import re
+import gzip
+import hashlib
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import Response
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
 import uvicorn
 
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
 # 初始化FastAPI应用
 app = FastAPI(title="Hierarchical Agent Teams", description="Hierarchical Agent Teams Demo With Vue.js")
 
 # 获取当前文件所在目录
 current_dir = os.path.dirname(os.path.abspath(__file__))
 
-# 挂载静态文件目录 - 将css目录明确挂载到/css路径
-app.mount("/css", StaticFiles(directory=os.path.join(current_dir, "css")), name="css")
-# 挂载js目录到/js路径
-app.mount("/js", StaticFiles(directory=os.path.join(current_dir, "js")), name="js")
+ASSET_DIRS = ("css", "js")
+MEDIA_TYPES = {".css": "text/css; charset=utf-8", ".js": "application/javascript; charset=utf-8",
+               ".html": "text/html; charset=utf-8"}
+# Hashed asset URLs never change content, the page itself is always revalidated
+IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE = "no-cache"
+# Preferred content codings, best first; each variant gets its own ETag suffix
+ENCODINGS = ("br", "gzip")
+ETAG_SUFFIXES = {"br": "-br", "gzip": "-gz"}
+
+
+class Asset:
+    """A static file with its content hash and precompressed variants"""
+
+    def __init__(self, path: str, content: bytes, media_type: str):
+        self.path = path
+        self.content = content
+        self.media_type = media_type
+        self.digest = hashlib.sha256(content).hexdigest()[:12]
+        self.encodings = {"gzip": gzip.compress(content, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            self.encodings["br"] = brotli.compress(content)
+
+    def etag(self, encoding: str = None) -> str:
+        """Strong ETag of one representation, the compressed variants differ from the identity one"""
+        return f'"{self.digest}{ETAG_SUFFIXES.get(encoding, "")}"'
+
+    @property
+    def hashed_path(self) -> str:
+        stem, ext = os.path.splitext(self.path)
+        return f"{stem}.{self.digest}{ext}"
+
+
+def _load_assets() -> dict:
+    """Read css/ and js/ once at startup, keyed by their relative path"""
+    assets = {}
+    for directory in ASSET_DIRS:
+        for name in sorted(os.listdir(os.path.join(current_dir, directory))):
+            ext = os.path.splitext(name)[1]
+            if ext not in MEDIA_TYPES:
+                continue
+            with open(os.path.join(current_dir, directory, name), "rb") as f:
+                assets[f"{directory}/{name}"] = Asset(f"{directory}/{name}", f.read(), MEDIA_TYPES[ext])
+    return assets
+
+
+def _build_index(assets: dict) -> Asset:
+    """The page, with asset references rewritten to their content-hashed names"""
+    with open(os.path.join(current_dir, "vue-app.html"), "r", encoding="utf-8") as f:
+        html = f.read()
+    for path, asset in assets.items():
+        html = re.sub(rf'(["\']){re.escape(path)}\1', rf"\1{asset.hashed_path}\1", html)
+    return Asset("vue-app.html", html.encode("utf-8"), MEDIA_TYPES[".html"])
+
+
+assets = _load_assets()
+hashed_assets = {asset.hashed_path: asset for asset in assets.values()}
+index = _build_index(assets)
+
+
+def _accepted_encodings(header: str) -> dict:
+    """Parse Accept-Encoding into {coding: q}, codings with q=0 are refused"""
+    accepted = {}
+    for item in header.split(","):
+        coding, *params = [part.strip() for part in item.split(";")]
+        if not coding:
+            continue
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[coding.lower()] = q
+    return accepted
+
+
+def _choose_encoding(asset: Asset, header: str):
+    """Best available coding the client accepts, None for the uncompressed content"""
+    accepted = _accepted_encodings(header)
+    best, best_q = None, 0.0
+    for encoding in ENCODINGS:
+        q = accepted.get(encoding, accepted.get("*", 0.0))
+        # Strictly greater keeps the earlier, preferred coding on ties
+        if encoding in asset.encodings and q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    """If-None-Match uses weak comparison and may list several tags"""
+    tags = [tag.strip() for tag in header.split(",")]
+    return "*" in tags or etag in (tag[2:] if tag.startswith("W/") else tag for tag in tags)
+
+
+def _serve(request: Request, asset: Asset, cache_control: str) -> Response:
+    encoding = _choose_encoding(asset, request.headers.get("accept-encoding", ""))
+    etag = asset.etag(encoding)
+    headers = {"ETag": etag, "Cache-Control": cache_control, "Vary": "Accept-Encoding"}
+    if _etag_matches(request.headers.get("if-none-match", ""), etag):
+        return Response(status_code=304, headers=headers)
+    if encoding is None:
+        return Response(asset.content, media_type=asset.media_type, headers=headers)
+    headers["Content-Encoding"] = encoding
+    return Response(asset.encodings[encoding], media_type=asset.media_type, headers=headers)
+
 
 @app.get("/")
-async def read_index():
-    return FileResponse(os.path.join(current_dir, "vue-app.html"))
+async def read_index(request: Request):
+    return _serve(request, index, REVALIDATE_CACHE)
+
+# 静态文件：带内容哈希的文件名长期缓存，原始文件名每次重新验证
+@app.get("/{directory}/{name}")
+async def read_asset(request: Request, directory: str, name: str):
+    path = f"{directory}/{name}"
+    if path in hashed_assets:
+        return _serve(request, hashed_assets[path], IMMUTABLE_CACHE)
+    if path in assets:
+        return _serve(request, assets[path], REVALIDATE_CACHE)
+    if directory in static_dirs:
+        # Other file types are served as they are, like the mounts below do for subdirectories
+        return await static_dirs[directory].get_response(name, request.scope)
+    raise HTTPException(status_code=404, detail=f"{path} not found")
+
+# 挂载css和js目录，处理未预压缩的文件（如子目录、图片、字体）
+static_dirs = {directory: StaticFiles(directory=os.path.join(current_dir, directory)) for directory in ASSET_DIRS}
+for directory, static_files in static_dirs.items():
+    app.mount(f"/{directory}", static_files, name=directory)
 
 # 如果直接运行此文件，启动前端服务器
 if __name__ == "__main__":